@@ -0,0 +1,338 @@
+"""
+Streaming detector for unusual access patterns.
+
+Every scan is checked, in constant time and memory, for:
+
+    denied_burst    DENIED_LIMIT denied scans of one card within DENIED_WINDOW seconds
+    off_hours       a granted scan outside WORK_HOURS on WORK_DAYS (local time)
+    rate_spike      a reader seeing far more scans in a RATE_BUCKET than its
+                    EWMA baseline says it should
+    unknown_uid     a card that isn't any user's RFID_key
+
+and alerts are written to the flaskr `alerts` table (run `flask init-db`
+first), where the GUI shows them. The same alert for the same card or reader
+is raised at most once per ALERT_COOLDOWN.
+
+It is fed either live, by `python esp32.py --detect`, or by following
+accessLog:
+
+    python anomaly.py [--database instance/flaskr.sqlite] [--from-start]
+
+which remembers how far it got in the alertCheckpoint table. accessLog
+doesn't record which reader a scan came from, so in that mode rate spikes
+are judged across all readers together.
+"""
+
+import argparse
+import logging
+import math
+import os
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple
+
+
+# ── Configuration ────────────────────────────────────────────
+DATABASE = os.path.join("instance", "flaskr.sqlite")   # The flaskr app's database
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+DENIED_LIMIT  = 5        # Denied scans of one card...
+DENIED_WINDOW = 60.0     # ...within this many seconds
+WORK_HOURS    = (7, 19)  # Granted scans are expected from 07:00 until 19:00...
+WORK_DAYS     = (0, 1, 2, 3, 4)   # ...Monday to Friday
+
+RATE_BUCKET     = 60.0   # Seconds of scans counted together per reader
+RATE_ALPHA      = 0.1    # Weight of the newest bucket in the EWMA baseline
+RATE_SIGMAS     = 4.0    # Standard deviations above the baseline that count as a spike...
+RATE_MIN_EVENTS = 20     # ...as long as it's at least this many scans
+RATE_WARMUP     = 10     # Buckets of baseline needed before spikes are reported
+RATE_MAX_GAP    = 50     # Empty buckets folded into the baseline after a quiet spell (more changes nothing)
+
+ALERT_COOLDOWN     = 300.0     # Seconds before the same alert is raised again for the same card/reader
+MAX_TRACKED_CARDS  = 100_000   # The least recently seen cards are forgotten beyond this...
+MAX_TRACKED_DOORS  = 10_000    # ...and readers beyond this
+KNOWN_UIDS_REFRESH = 60.0      # Seconds between re-reading users.RFID_key
+
+POLL_INTERVAL = 1.0      # Seconds between looks at accessLog when following it
+TAIL_BATCH    = 10_000   # accessLog rows read at a time
+
+
+log = logging.getLogger("anomaly")
+
+
+class Alert(NamedTuple):
+    raised: datetime
+    kind: str
+    uid: str
+    door: str | None
+    detail: str
+
+
+# ── Detector ─────────────────────────────────────────────────
+class CardState:
+    __slots__ = ("denied", "alerted")
+
+    def __init__(self):
+        self.denied = deque(maxlen=DENIED_LIMIT)   # Times of the last few denied scans
+        self.alerted = {}                          # Alert kind -> when it was last raised
+
+
+class DoorState:
+    __slots__ = ("bucket", "count", "threshold", "mean", "variance", "buckets", "alerted")
+
+    def __init__(self, bucket: int):
+        self.bucket = bucket
+        self.count = 0
+        self.threshold = math.inf
+        self.mean = 0.0
+        self.variance = 0.0
+        self.buckets = 0
+        self.alerted = {}
+
+
+class BoundedStates(OrderedDict):
+    """Per-key state that forgets the least recently used keys beyond max_size."""
+
+    def __init__(self, factory: Callable, max_size: int):
+        super().__init__()
+        self.factory = factory
+        self.max_size = max_size
+
+    def get_state(self, key, *args):
+        state = self.get(key)
+        if state is None:
+            state = self[key] = self.factory(*args)
+            if len(self) > self.max_size:
+                self.popitem(last=False)
+        else:
+            self.move_to_end(key)
+        return state
+
+
+class AnomalyDetector:
+    """
+    Checks scans one at a time, keeping a small fixed amount of state per
+    card and per reader. known_uids, if given, returns the set of cards
+    that belong to users; it is called again every KNOWN_UIDS_REFRESH seconds.
+    """
+
+    def __init__(self, known_uids: Callable[[], set] | None = None):
+        self.cards = BoundedStates(CardState, MAX_TRACKED_CARDS)
+        self.doors = BoundedStates(DoorState, MAX_TRACKED_DOORS)
+
+        self._load_known_uids = known_uids
+        self._known_uids = None
+        self._known_loaded_at = -math.inf
+
+    def observe_events(self, events: list[tuple]) -> list[Alert]:
+        """Check (received, uid, granted, device_millis, door) events, as the esp32.py sinks get them."""
+        alerts = []
+        for received, uid, granted, _, door in events:
+            alerts.extend(self.observe(received, uid, granted, door))
+        return alerts
+
+    def observe(self, received: datetime, uid: str, granted: bool, door: str | None) -> list[Alert]:
+        """Check one scan; received is timezone-aware. Returns any alerts it raises."""
+        now = received.timestamp()
+        card = self.cards.get_state(uid)
+        alerts = []
+
+        def alert(state, kind: str, detail: str, subject=uid):
+            if now - state.alerted.get(kind, -math.inf) >= ALERT_COOLDOWN:
+                state.alerted[kind] = now
+                alerts.append(Alert(received, kind, uid, door, detail))
+                log.info("%s: %s (%s at %s)", kind, detail, uid, door or "unknown reader")
+
+        known = self._known()
+        if known is not None and uid not in known:
+            alert(card, "unknown_uid", "Card does not belong to any user")
+
+        if granted:
+            local = received.astimezone()
+            if local.weekday() not in WORK_DAYS or not WORK_HOURS[0] <= local.hour < WORK_HOURS[1]:
+                alert(card, "off_hours", f"Access granted at {local:%a %H:%M} local time")
+        else:
+            card.denied.append(now)
+            if len(card.denied) == DENIED_LIMIT and now - card.denied[0] <= DENIED_WINDOW:
+                alert(card, "denied_burst",
+                      f"{DENIED_LIMIT} denied scans in {now - card.denied[0]:.0f}s")
+
+        bucket = int(now // RATE_BUCKET)
+        reader = self.doors.get_state(door, bucket)
+        if bucket > reader.bucket:
+            self._close_buckets(reader, bucket)
+        reader.count += 1
+        if reader.count > reader.threshold:
+            alert(reader, "rate_spike",
+                  f"{reader.count} scans in {RATE_BUCKET:.0f}s against a usual {reader.mean:.1f}")
+
+        return alerts
+
+    def _close_buckets(self, reader: DoorState, bucket: int):
+        """Fold the finished bucket, and any empty ones since, into the reader's EWMA baseline."""
+        counts = [reader.count] + [0] * min(bucket - reader.bucket - 1, RATE_MAX_GAP)
+        for count in counts:
+            difference = count - reader.mean
+            increment = RATE_ALPHA * difference
+            reader.mean += increment
+            reader.variance = (1 - RATE_ALPHA) * (reader.variance + difference * increment)
+            reader.buckets += 1
+
+        reader.bucket = bucket
+        reader.count = 0
+        if reader.buckets >= RATE_WARMUP:
+            reader.threshold = max(RATE_MIN_EVENTS, reader.mean + RATE_SIGMAS * math.sqrt(reader.variance))
+
+    def _known(self) -> set | None:
+        if self._load_known_uids is None:
+            return None
+
+        if time.monotonic() - self._known_loaded_at >= KNOWN_UIDS_REFRESH:
+            self._known_loaded_at = time.monotonic()
+            try:
+                self._known_uids = self._load_known_uids()
+            except sqlite3.Error as e:
+                log.warning("Could not read the users table, keeping the last list: %s", e)
+        return self._known_uids
+
+
+# ── Alert storage ────────────────────────────────────────────
+ALERT_INSERT = "INSERT INTO alerts (raised, kind, RFID_key, door, detail) VALUES (?, ?, ?, ?, ?)"
+CHECKPOINT_UPSERT = """
+    INSERT INTO alertCheckpoint (id, last_id) VALUES (1, ?)
+    ON CONFLICT (id) DO UPDATE SET last_id = excluded.last_id
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+
+    if db.execute("SELECT 1 FROM sqlite_master WHERE name = 'alerts'").fetchone() is None:
+        db.close()
+        raise SystemExit(f"No alerts table in '{path}'; run `flask init-db` to add it")
+    return db
+
+
+def sqlite_timestamp(moment: datetime) -> str:
+    """Same format as accessLog.accessed: naive UTC with microseconds."""
+    return moment.astimezone(timezone.utc).replace(tzinfo=None).isoformat(sep=" ", timespec="microseconds")
+
+
+class AlertStore:
+    """
+    Writes alerts to the alerts table. If the database is busy or
+    unavailable they (and the accessLog position that goes with them) are
+    kept and written with the next lot, so a detector feeding it never has
+    to stop for the database.
+    """
+
+    def __init__(self, path: str = DATABASE):
+        self.path = path
+        self._db = connect(path)
+        self._pending = []
+        self._last_id = None        # Checkpoint not yet written
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._pending) or self._last_id is not None
+
+    def known_uids(self) -> set:
+        return {uid for (uid,) in self._db.execute("SELECT RFID_key FROM users WHERE RFID_key IS NOT NULL")}
+
+    def checkpoint(self) -> int | None:
+        row = self._db.execute("SELECT last_id FROM alertCheckpoint WHERE id = 1").fetchone()
+        return None if row is None else row[0]
+
+    def write(self, alerts: list[Alert], last_id: int | None = None) -> bool:
+        """Write alerts (and, when following accessLog, how far it got) in one transaction."""
+        self._pending.extend(
+            (sqlite_timestamp(alert.raised), alert.kind, alert.uid, alert.door, alert.detail) for alert in alerts
+        )
+        if last_id is not None:
+            self._last_id = last_id
+        if not self.pending:
+            return True
+
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(ALERT_INSERT, self._pending)
+                if self._last_id is not None:
+                    self._db.execute(CHECKPOINT_UPSERT, (self._last_id,))
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        except sqlite3.Error as e:
+            log.warning("Could not write %d alerts to '%s', will retry: %s", len(self._pending), self.path, e)
+            return False
+
+        self._pending.clear()
+        self._last_id = None
+        return True
+
+    def close(self):
+        self.write([])
+        self._db.close()
+
+
+# ── Following accessLog ──────────────────────────────────────
+NEW_ACCESSES = """
+    SELECT id, RFID_key, accessed, is_authorised FROM accessLog
+    WHERE id > ? ORDER BY id LIMIT ?
+"""
+
+
+def follow_access_log(store: AlertStore, detector: AnomalyDetector, from_start: bool = False):
+    """Check accessLog rows as they arrive, forever."""
+    db = store._db
+    last_id = store.checkpoint()
+    if last_id is None:
+        last_id = 0 if from_start else db.execute("SELECT COALESCE(MAX(id), 0) FROM accessLog").fetchone()[0]
+    log.info("Following accessLog in '%s' from id %d", store.path, last_id)
+
+    while True:
+        rows = db.execute(NEW_ACCESSES, (last_id, TAIL_BATCH)).fetchall()
+        if not rows:
+            if store.pending:
+                store.write([])     # Retry just the write; its rows were observed already
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        alerts = []
+        for row_id, uid, accessed, authorised in rows:
+            received = datetime.fromisoformat(accessed).replace(tzinfo=timezone.utc)
+            alerts.extend(detector.observe(received, uid, bool(authorised), None))
+
+        # The detector has counted these rows, so move on whether or not the
+        # write lands: reading them again would count them twice. A failed
+        # write leaves the alerts and position pending in store
+        last_id = rows[-1][0]
+        if not store.write(alerts, last_id):
+            time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flag unusual access patterns in accessLog")
+    parser.add_argument("--database", default=DATABASE, help="The flaskr database to read and write alerts to")
+    parser.add_argument(
+        "--from-start", action="store_true",
+        help="With no checkpoint yet, check all of accessLog rather than only new scans"
+    )
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="INFO")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)-7s %(message)s")
+
+    store = AlertStore(args.database)
+    detector = AnomalyDetector(store.known_uids)
+    try:
+        follow_access_log(store, detector, args.from_start)
+    except KeyboardInterrupt:
+        log.info("Stopped.")
+    finally:
+        store.close()
@@ -19,15 +19,24 @@
 const char* host = "192.168.1.50";   // Private server IP
 const uint16_t port = 5000;         // Private API port
 
+// == Binary event frames (see esp32.py) ======================
+#define USE_BINARY_FRAMES 0          // 1 = send binary frames instead of CSV lines
+#define FRAME_MAGIC       0xA5
+#define FRAME_BODY_LEN    (1 + MAX_UID_LEN + 1 + 4 + 2)
+
 // == Objects =================================================
 MFRC522     mfrc522(SS_PIN, RST_PIN);
-WiFiClient  client;
+WiFiClient  client;       // Kept open between scans
 Preferences prefs;
 
+uint32_t sentSeq = 0;     // Events sent on the current connection
+
 // WiFi credentials loaded from NVS
 String ssid;
 String pass;
 
+uint16_t deviceId;        // Sent in binary frames, provisioned in NVS
+
 
 // ============================================================
 // setup()
@@ -46,6 +55,7 @@ void setup() {
   // Load WiFi credentials from NVS
   ssid = prefs.getString("wifi_ssid", "");
   pass = prefs.getString("wifi_pass", "");
+  deviceId = prefs.getUShort("device_id", 0);
 
   if (ssid == "" || pass == "") {
     Serial.println("WiFi credentials not set in NVS!");
@@ -82,6 +92,9 @@ void loop() {
   digitalWrite(GREEN_LED, LOW);
   digitalWrite(RED_LED, LOW);
 
+  // Pick up acks for events sent on the kept-open connection
+  readAcks();
+
   if (!mfrc522.PICC_IsNewCardPresent()) return;
   if (!mfrc522.PICC_ReadCardSerial())   return;
 
@@ -102,7 +115,11 @@ void loop() {
     digitalWrite(RED_LED, HIGH);
   }
 
+#if USE_BINARY_FRAMES
+  sendBinaryEvent(mfrc522.uid.uidByte, mfrc522.uid.size, granted);
+#else
   sendAccessEvent(content, granted);
+#endif
 
   mfrc522.PICC_HaltA();
   delay(2000);
@@ -112,12 +129,14 @@ void loop() {
 // ============================================================
 // sendAccessEvent()
 // ============================================================
+// The connection is kept open between scans and every event is
+// answered with "ACK <seq>" or "NAK <seq>". Acks are read back
+// without blocking, so events can be pipelined. The server's
+// blocking mode closes the connection after each burst instead;
+// ensureConnected() then reconnects for the next scan.
 void sendAccessEvent(const String& uid, bool granted) {
 
-  if (!client.connect(host, port)) {
-    Serial.println("Server unreachable");
-    return;
-  }
+  if (!ensureConnected()) return;
 
   // UID, Granted(1/0), Timestamp, Device Token
   String payload = uid + "," +
@@ -126,10 +145,81 @@ void sendAccessEvent(const String& uid, bool granted) {
                    deviceToken + "\n";
 
   client.print(payload);
-  client.stop();
+  sentSeq++;
 
-  Serial.print("Sent: ");
+  Serial.print("Sent #");
+  Serial.print(sentSeq);
+  Serial.print(": ");
   Serial.println(payload);
+
+  readAcks();
+}
+
+
+// ============================================================
+// sendBinaryEvent()
+// ============================================================
+// Same event as sendAccessEvent(), as a fixed-layout frame:
+// magic, body length, UID length, UID (zero padded), granted,
+// millis (uint32) and device id (uint16), all big-endian.
+void sendBinaryEvent(const uint8_t* uid, uint8_t uidLen, bool granted) {
+
+  if (!ensureConnected()) return;
+
+  uint8_t frame[2 + FRAME_BODY_LEN] = {};
+  uint32_t now = millis();
+  uint8_t* p = frame;
+
+  *p++ = FRAME_MAGIC;
+  *p++ = FRAME_BODY_LEN;
+  *p++ = uidLen;
+  memcpy(p, uid, uidLen);
+  p += MAX_UID_LEN;
+  *p++ = granted ? 1 : 0;
+  *p++ = now >> 24;
+  *p++ = now >> 16;
+  *p++ = now >> 8;
+  *p++ = now;
+  *p++ = deviceId >> 8;
+  *p++ = deviceId;
+
+  client.write(frame, sizeof(frame));
+  sentSeq++;
+
+  Serial.print("Sent binary #");
+  Serial.println(sentSeq);
+
+  readAcks();
+}
+
+
+// ============================================================
+// ensureConnected()
+// ============================================================
+bool ensureConnected() {
+  if (client.connected()) return true;
+
+  client.stop();
+  sentSeq = 0;
+
+  if (!client.connect(host, port)) {
+    Serial.println("Server unreachable");
+    return false;
+  }
+  client.setNoDelay(true);
+  return true;
+}
+
+
+// ============================================================
+// readAcks()
+// ============================================================
+void readAcks() {
+  while (client.available()) {
+    String ack = client.readStringUntil('\n');
+    Serial.print("Server: ");
+    Serial.println(ack);
+  }
 }
 
 
@@ -0,0 +1,79 @@
+"""
+Compares the per-event parse cost of CSV lines and binary frames.
+
+Both formats are pushed through esp32.EventFramer in BUFFER_SIZE reads,
+the way the servers receive them, and taken as far as the
+(uid, granted, millis) tuple that gets handed to the sink.
+
+    python bench_parse.py [--events N] [--repeat R]
+"""
+
+import argparse
+import random
+import time
+
+import esp32
+
+
+def make_stream(events: int, binary: bool) -> bytes:
+    """Build a byte stream of random scans in one format."""
+    rng = random.Random(0)
+    chunks = []
+    for i in range(events):
+        uid = rng.randbytes(4).hex().upper()
+        granted = rng.random() < 0.9
+        millis = rng.randrange(2 ** 32)
+        if binary:
+            chunks.append(esp32.encode_frame(uid, granted, millis, i % 64))
+        else:
+            chunks.append(f"{uid},{int(granted)},{millis}\n".encode())
+    return b"".join(chunks)
+
+
+def parse_csv_stream(stream: memoryview) -> int:
+    framer = esp32.EventFramer()
+    parsed = 0
+    for offset in range(0, len(stream), esp32.BUFFER_SIZE):
+        for line in framer.feed(stream[offset:offset + esp32.BUFFER_SIZE]):
+            if esp32.parse_payload(line.decode("utf-8")) is not None:
+                parsed += 1
+    return parsed
+
+
+def parse_binary_stream(stream: memoryview) -> int:
+    framer = esp32.EventFramer()
+    parsed = 0
+    for offset in range(0, len(stream), esp32.BUFFER_SIZE):
+        for frame in framer.feed(stream[offset:offset + esp32.BUFFER_SIZE]):
+            if frame is not None:
+                parsed += 1
+    return parsed
+
+
+def bench(name: str, parse, stream: bytes, events: int, repeat: int):
+    view = memoryview(stream)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parsed = parse(view)
+        best = min(best, time.perf_counter() - start)
+
+    if parsed != events:
+        raise RuntimeError(f"{name}: parsed {parsed} of {events} events")
+
+    print(f"{name:<8} {len(stream) / events:6.1f} bytes/event  "
+          f"{best / events * 1e9:8.0f} ns/event  {events / best:12,.0f} events/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CSV vs binary event parsing")
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per format; the best is reported")
+    args = parser.parse_args()
+
+    bench("csv", parse_csv_stream, make_stream(args.events, binary=False), args.events, args.repeat)
+    bench("binary", parse_binary_stream, make_stream(args.events, binary=True), args.events, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
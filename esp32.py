@@ -7,12 +7,59 @@ The ESP32 sends a single CSV line per scan:
     UID     - hex string, e.g. "BD 31 15 2B"
     GRANTED - 1 (access granted) or 0 (access denied)
     MILLIS  - milliseconds since the ESP32 last booted
+
+Readers may instead send the compact binary frame described under "Binary
+frames" below; the two formats are told apart by their first byte.
+
+A reader may close after each event, or keep the connection open and stream
+many (in async and supervisor modes; the blocking server closes it after
+the first burst, so one idle reader can't hold up the rest). Every event is answered in order with "ACK <seq>\n" once it has been
+written to the sink (and fsynced, unless --durability is flush) or
+"NAK <seq>\n" if it was rejected, where <seq> counts the events sent on
+that connection starting from 1. Acks wait for the batch holding the
+events, so readers sending at the same time share one write; a reader
+whose events can't be written within ACK_TIMEOUT is dropped unacked.
+
+Run with `--mode async` to serve many readers concurrently on one event loop,
+or `--mode supervisor` to spread that across several worker processes.
+Events go to the CSV log by default, straight into the flaskr accessLog
+table with `--sink sqlite`, or through a crash-safe journal into accessLog
+with `--sink journal --durability batch`.
+
+Progress is logged through the "esp32" logger (`--log-level DEBUG` shows
+every event), and counters plus per-stage latency histograms are served in
+the Prometheus text format on http://127.0.0.1:9105/metrics.
+
+With `--sink archive` the CSV log is split into daily or hourly segments,
+compressed once closed and indexed by time; `--read-archive START END`
+prints just the rows in a time window.
+
+With `--detect` every event is also checked for unusual access (repeated
+denials, off-hours entry, scan rate spikes, unknown cards) and alerts are
+written to the flaskr alerts table; see anomaly.py.
 """
 
+import argparse
+import asyncio
+import bisect
 import csv
+import gzip
+import json
+import logging
+import lzma
+import multiprocessing
+import signal
 import socket
+import sqlite3
 import os
+import shutil
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict
 from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 
 # ── Configuration ────────────────────────────────────────────
@@ -20,23 +67,842 @@ HOST        = "192.168.1.50"
 PORT        = 5000
 BUFFER_SIZE = 1024
 LOG_FILE    = "access_log.csv"
+DATABASE    = os.path.join("instance", "flaskr.sqlite")   # The flaskr app's database
+
+# SQLite sink
+ACTION_TYPE            = "scan"   # accessLog.actiontype recorded for reader events
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+# Async server mode
+LISTEN_BACKLOG  = 512     # Pending connections the kernel will queue
+READ_TIMEOUT    = 5.0     # Seconds a reader may stall part-way through an event
+IDLE_TIMEOUT    = 300.0   # Seconds a keep-alive reader may go without sending anything
+MAX_CONNECTIONS = 1000    # Concurrent reader connections served at once
+ACK_TIMEOUT     = 5.0     # Seconds to wait for events to be written before dropping the reader unacked
+
+# Log writer batching
+FLUSH_EVENTS     = 500     # Write the buffer once this many events are queued...
+FLUSH_INTERVAL   = 0.05    # ...or once this many seconds have passed
+DURABILITY       = "flush" # See DURABILITY_MODES below
+DURABILITY_MODES = (
+    "flush",  # Hand each batch to the OS, no fsync (fastest)
+    "batch",  # fsync once per batch
+    "event",  # fsync after every event (slowest, nothing buffered)
+)
+
+# Write-ahead journal
+JOURNAL_DIR          = "journal"
+JOURNAL_SEGMENT_SIZE = 64 * 1024 * 1024   # Bytes before the journal moves to a new segment
+APPLY_BATCH          = 50_000             # Journal records per accessLog transaction
+APPLY_INTERVAL       = 1.0                # Seconds between passes of the applier
+JOURNAL_QUARANTINE   = "quarantine.log"   # Where records that can't be parsed are moved to
+
+# Segmented archive
+ARCHIVE_DIR         = "access_log"
+SEGMENT_PERIOD      = "daily"   # "daily" or "hourly"
+ARCHIVE_COMPRESSION = "gzip"    # "gzip" or "lzma", for segments that are closed
+INDEX_EVERY         = 1000      # Rows between byte-offset marks in the index
+
+# Supervisor mode
+WORKERS         = os.cpu_count() or 1   # Ingest worker processes sharing the port
+QUEUE_BATCH     = 200     # Events a worker sends to the writer stage in one go
+QUEUE_MAX       = 1000    # Batches in flight before workers wait for the writer
+RESTART_DELAY   = 1.0     # Seconds before replacing a worker that died
+
+# Metrics endpoint
+METRICS_HOST    = "127.0.0.1"   # Only reachable from this machine
+METRICS_PORT    = 9105          # Supervisor workers use the ports just above
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+log = logging.getLogger("esp32")
+
+
+# ── Metrics ──────────────────────────────────────────────────
+STAGES = (
+    "accept",   # Connection accepted -> handler ready (waits for a free slot)
+    "recv",     # Framing each chunk of received bytes
+    "parse",    # Decoding and validating one event
+    "write",    # Queueing one event on the sink
+    "batch",    # Writing one batch out to the CSV log, database or journal
+    "ack",      # Waiting for a reader's events to be written before acking them
+    "close",    # Closing a reader connection
+)
+
+class Histogram:
+    """Latency histogram with fixed buckets, in the Prometheus style."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
 
+    def render(self, name: str, labels: str) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
 
-# ── CSV log setup ────────────────────────────────────────────
+
+class Metrics:
+    """
+    In-process counters and per-stage latency histograms for the ingest path.
+    Counters take labels, e.g. count("device_events_total", client_ip=ip).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._stages = {stage: Histogram() for stage in STAGES}
+
+    def count(self, name: str, amount: int = 1, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] += amount
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self._stages[stage].observe(seconds)
+
+    def render(self) -> str:
+        """Everything so far, in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            lines = ["# TYPE esp32_stage_seconds histogram"]
+            for stage, histogram in self._stages.items():
+                lines += histogram.render("esp32_stage_seconds", f'stage="{stage}"')
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE esp32_{name} counter")
+                typed.add(name)
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            lines.append(f"esp32_{name}{{{label_text}}} {value}" if labels else f"esp32_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("Metrics request from %s: " + format, self.client_address[0], *args)
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> ThreadingHTTPServer:
+    """Serve METRICS at http://host:port/metrics on a background thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info("Metrics at http://%s:%d/metrics", host, port)
+    return server
+
+
+# ── Batched event writers ───────────────────────────────────
+class BatchWriter:
+    """
+    Base class for long-lived, buffered event sinks.
+
+    Events are queued in memory and handed to _write_batch() once
+    flush_events have built up or flush_interval seconds have passed,
+    so the sink is opened once instead of once per scan. Call close() on
+    shutdown so the last partial batch is written.
+
+    Each queued event gets a position (1, 2, 3... in queueing order), and
+    `written` is the position up to which events have been written (and
+    fsynced, unless durability is "flush"). Servers hold a reader's acks
+    until its events are written, so every connection waiting on the same
+    batch is acked by the one write (group commit).
+    """
+
+    # False for sinks whose _write_batch only hands events on; they call
+    # confirm() once the events have really been written
+    confirms_on_write = True
+
+    def __init__(self, flush_events: int = FLUSH_EVENTS, flush_interval: float = FLUSH_INTERVAL,
+                 durability: str = DURABILITY):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}, expected one of {DURABILITY_MODES}")
+
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+        self.durability = durability
+
+        self._pending = []
+        self._lock = threading.Lock()
+
+        self.queued = 0         # Position of the last event queued...
+        self.written = 0        # ...and of the last one written
+        self._waiters = []      # (position, callback) for when_written()
+
+        # Background timer so a quiet period still flushes the last few events
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def write(self, uid: str, granted: bool, device_millis: str, client_ip: str) -> int:
+        """Queue one access event, timestamped now. Returns its position."""
+        return self.write_events([(datetime.now(timezone.utc), uid, granted, device_millis, client_ip)])
+
+    def write_events(self, events: list[tuple]) -> int:
+        """
+        Queue already-timestamped (received, uid, granted, device_millis, client_ip)
+        events. Returns the position of the last one.
+        """
+        with self._lock:
+            self._pending.extend(events)
+            self.queued += len(events)
+            position = self.queued
+            if self.durability == "event" or len(self._pending) >= self.flush_events:
+                self._flush_locked()
+        return position
+
+    def when_written(self, position: int, callback):
+        """
+        Call callback() once every event up to position has been written:
+        straight away if they already are, otherwise on the thread that
+        writes them. callback mustn't block or use this writer.
+        """
+        with self._lock:
+            if self.written < position:
+                self._waiters.append((position, callback))
+                return
+        callback()
+
+    def wait_written(self, position: int, timeout: float) -> bool:
+        """Block until every event up to position has been written. False if timeout passed first."""
+        done = threading.Event()
+        self.when_written(position, done.set)
+        return done.wait(timeout)
+
+    def confirm(self, position: int):
+        """Note that every event up to position has been written (for sinks that don't confirm on write)."""
+        with self._lock:
+            self._confirm_locked(position)
+
+    def flush(self):
+        """Write out everything queued so far."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Stop the timer and write the final batch."""
+        self._stopped.set()
+        self._flusher.join()
+        self.flush()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+
+        started = time.perf_counter()
+        try:
+            self._write_batch(self._pending)
+        except (OSError, sqlite3.Error) as e:
+            # Keep the batch queued and try again on the next flush
+            log.warning("Could not write %d events to '%s', will retry: %s", len(self._pending), self.path, e)
+            METRICS.count("batch_failures_total")
+            return
+
+        METRICS.observe("batch", time.perf_counter() - started)
+        METRICS.count("batches_written_total")
+        METRICS.count("events_written_total", len(self._pending))
+
+        self._pending.clear()
+        if self.confirms_on_write:
+            self._confirm_locked(self.queued)
+
+    def _confirm_locked(self, position: int):
+        self.written = max(self.written, position)
+        waiting = [waiter for waiter in self._waiters if waiter[0] > self.written]
+        ready = [callback for at, callback in self._waiters if at <= self.written]
+        self._waiters = waiting
+        for callback in ready:
+            callback()
+
+    def _write_batch(self, events: list[tuple]):
+        raise NotImplementedError
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+
+# ── CSV log ──────────────────────────────────────────────────
 CSV_HEADERS = ["timestamp_utc", "uid", "granted", "device_millis", "client_ip"]
 
-def initialise_log():
+def initialise_log(path: str = LOG_FILE):
     """Create the CSV log file with headers if it does not already exist."""
-    if not os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "w", newline="") as f:
+    if not os.path.exists(path):
+        with open(path, "w", newline="") as f:
             csv.writer(f).writerow(CSV_HEADERS)
 
 
-def log_event(uid: str, granted: bool, device_millis: str, client_ip: str):
-    """Append one access event to the CSV log."""
-    timestamp = datetime.now(timezone.utc).isoformat()
-    with open(LOG_FILE, "a", newline="") as f:
-        csv.writer(f).writerow([timestamp, uid, int(granted), device_millis, client_ip])
+class LogWriter(BatchWriter):
+    """Buffered writer that appends events to the CSV log."""
+
+    def __init__(self, path: str = LOG_FILE, **kwargs):
+        initialise_log(path)
+
+        self.path = path
+        self._file = open(path, "a", newline="")
+        self._csv = csv.writer(self._file)
+        super().__init__(**kwargs)
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+    def _write_batch(self, events):
+        self._csv.writerows(
+            [received.isoformat(), uid, int(granted), device_millis, client_ip]
+            for received, uid, granted, device_millis, client_ip in events
+        )
+        self._file.flush()
+
+        if self.durability != "flush":
+            os.fsync(self._file.fileno())
+
+
+# ── SQLite accessLog ─────────────────────────────────────────
+ACCESS_LOG_INSERT = """
+    INSERT INTO accessLog (RFID_key, accessed, received, actiontype, is_authorised)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+def sqlite_timestamp(moment: datetime) -> str:
+    """Format a UTC datetime the way SQLite's CURRENT_TIMESTAMP does, plus microseconds."""
+    return moment.astimezone(timezone.utc).replace(tzinfo=None).isoformat(sep=" ", timespec="microseconds")
+
+
+def connect_access_log(path: str, durability: str) -> sqlite3.Connection:
+    """Open a long-lived, autocommit WAL connection for writing accessLog."""
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+
+    # In WAL mode NORMAL only syncs at checkpoints, FULL syncs every commit
+    synchronous = "NORMAL" if durability == "flush" else "FULL"
+    db.execute(f"PRAGMA synchronous = {synchronous}")
+    return db
+
+
+def access_log_rows(events: list[tuple]) -> list[tuple]:
+    """Turn (received, uid, granted, device_millis, client_ip) events into accessLog rows."""
+    rows = []
+    for received, uid, granted, device_millis, client_ip in events:
+        timestamp = sqlite_timestamp(received)
+        rows.append((uid, timestamp, timestamp, ACTION_TYPE, int(granted)))
+    return rows
+
+
+class AccessLogWriter(BatchWriter):
+    """
+    Buffered writer that inserts events straight into the flaskr accessLog table.
+
+    Each batch is one executemany() transaction on a single long-lived
+    connection. The database is switched to WAL mode so the Flask readers
+    keep reading while a batch commits.
+
+    The ESP32 only reports its uptime, so `accessed` and `received` are
+    both the time the server received the scan.
+    """
+
+    def __init__(self, path: str = DATABASE, **kwargs):
+        self.path = path
+        super().__init__(**kwargs)
+        self._db = connect_access_log(path, self.durability)
+
+    def close(self):
+        super().close()
+        self._db.close()
+
+    def _write_batch(self, events):
+        rows = access_log_rows(events)
+
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.executemany(ACCESS_LOG_INSERT, rows)
+        except sqlite3.Error:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+
+# ── Write-ahead journal ──────────────────────────────────────
+JOURNAL_CHECKPOINT_TABLE = """
+    CREATE TABLE IF NOT EXISTS journalCheckpoint (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        segment INTEGER NOT NULL,
+        offset INTEGER NOT NULL
+    )
+"""
+
+def journal_segments(directory: str) -> list[int]:
+    """Numbers of the journal segments in `directory`, oldest first."""
+    return sorted(
+        int(name[:-len(".log")]) for name in os.listdir(directory)
+        if name.endswith(".log") and name[:-len(".log")].isdigit()
+    )
+
+
+def journal_segment_path(directory: str, segment: int) -> str:
+    return os.path.join(directory, f"{segment:08d}.log")
+
+
+def truncate_torn_record(path: str) -> int:
+    """
+    Cut a segment back to the end of its last complete record, dropping
+    whatever a crash left half-written after it. Returns the bytes dropped.
+    """
+    with open(path, "r+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - BUFFER_SIZE)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+    return size - end
+
+
+class JournalApplier:
+    """
+    Drains the journal into accessLog in large transactions.
+
+    The (segment, offset) reached is stored in journalCheckpoint in the same
+    transaction as the rows it covers, so after a crash or restart only the
+    unapplied tail is replayed and nothing is inserted twice. Segments the
+    writer has moved past are deleted once they are fully applied.
+    """
+
+    def __init__(self, directory: str = JOURNAL_DIR, database: str = DATABASE,
+                 batch_size: int = APPLY_BATCH, durability: str = DURABILITY):
+        self.directory = directory
+        self.database = database
+        self.batch_size = batch_size
+
+        self._db = connect_access_log(database, durability)
+        self._db.execute(JOURNAL_CHECKPOINT_TABLE)
+
+    def close(self):
+        self._db.close()
+
+    def checkpoint(self) -> tuple[int, int]:
+        row = self._db.execute("SELECT segment, offset FROM journalCheckpoint WHERE id = 1").fetchone()
+        return row if row is not None else (0, 0)
+
+    def apply(self) -> int:
+        """Apply every complete journal record not applied yet. Returns how many were applied."""
+        segment, offset = self.checkpoint()
+        segments = [n for n in journal_segments(self.directory) if n >= segment]
+        applied = 0
+
+        for position, number in enumerate(segments):
+            if number != segment:
+                offset = 0
+
+            path = journal_segment_path(self.directory, number)
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while records := self._read_events(f):
+                    offset += sum(length for length, _ in records)
+                    events = [event for _, event in records if event is not None]
+                    self._commit(events, number, offset)
+                    applied += len(events)
+
+            # The writer only moves on once a segment is complete
+            if position + 1 < len(segments):
+                self._commit([], segments[position + 1], 0)
+                os.remove(path)
+
+        return applied
+
+    def _read_events(self, f) -> list[tuple[int, tuple | None]]:
+        """
+        Read up to batch_size complete records as (length in bytes, event)
+        pairs. Records that can't be parsed are moved to the quarantine file
+        and come back with event None, so they are still skipped over.
+        """
+        events = []
+        while len(events) < self.batch_size:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                # End of the segment, or a record the writer has not finished yet
+                break
+            try:
+                received, uid, granted, device_millis, client_ip = line.decode("utf-8").rstrip("\n").split(",")
+                event = (datetime.fromisoformat(received), uid, granted == "1", device_millis, client_ip)
+            except ValueError as e:
+                self._quarantine(line, e)
+                event = None
+            events.append((len(line), event))
+        return events
+
+    def _quarantine(self, line: bytes, error: Exception):
+        path = os.path.join(self.directory, JOURNAL_QUARANTINE)
+        with open(path, "ab") as f:
+            f.write(line)
+        log.warning("Moved an unreadable journal record to '%s': %s", path, error)
+        METRICS.count("journal_quarantined_total")
+
+    def _commit(self, events: list[tuple], segment: int, offset: int):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.executemany(ACCESS_LOG_INSERT, access_log_rows(events))
+            self._db.execute(
+                "INSERT OR REPLACE INTO journalCheckpoint (id, segment, offset) VALUES (1, ?, ?)",
+                (segment, offset)
+            )
+        except sqlite3.Error:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+
+class JournalWriter(BatchWriter):
+    """
+    Sink that appends every event to a crash-safe, segment-rotated journal
+    and lets a background JournalApplier move it into accessLog.
+
+    Readers are acked once the journal append holding their events is
+    done (and fsynced, unless durability is "flush"), never waiting for the
+    database, so a locked or slow database just lets the journal grow until
+    the applier catches up.
+    Each record is one line: received,uid,granted,device_millis,client_ip.
+    A record left half-written by a crash is cut off when the journal is
+    next opened, and any line the applier can't parse is moved aside to
+    JOURNAL_QUARANTINE rather than stopping it.
+    """
+
+    def __init__(self, path: str = JOURNAL_DIR, database: str = DATABASE,
+                 segment_size: int = JOURNAL_SEGMENT_SIZE, apply_interval: float = APPLY_INTERVAL, **kwargs):
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.segment_size = segment_size
+        segments = journal_segments(path)
+        self._segment = segments[-1] if segments else 1
+
+        # A crash mid-append leaves a partial record that the next one
+        # would otherwise be glued onto
+        segment_path = journal_segment_path(path, self._segment)
+        if os.path.exists(segment_path) and (dropped := truncate_torn_record(segment_path)):
+            log.warning("Dropped %d bytes of a half-written record from '%s'", dropped, segment_path)
+        self._file = open(segment_path, "ab")
+
+        super().__init__(**kwargs)
+
+        # Replays whatever a previous run left unapplied straight away
+        self._applier = JournalApplier(path, database, durability=self.durability)
+        self._apply_interval = apply_interval
+        self._applying = threading.Thread(target=self._apply_periodically, daemon=True)
+        self._applying.start()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+        self._applying.join()
+        self._apply()
+        self._applier.close()
+
+    def _write_batch(self, events):
+        self._file.write("".join(
+            f"{received.isoformat()},{uid},{int(granted)},{device_millis},{client_ip}\n"
+            for received, uid, granted, device_millis, client_ip in events
+        ).encode("utf-8"))
+        self._file.flush()
+
+        if self.durability != "flush":
+            os.fsync(self._file.fileno())
+
+        if self._file.tell() >= self.segment_size:
+            self._file.close()
+            self._segment += 1
+            self._file = open(journal_segment_path(self.path, self._segment), "ab")
+
+    def _apply(self):
+        try:
+            self._applier.apply()
+        except (OSError, ValueError, sqlite3.Error) as e:
+            # The applier thread has to survive anything, or the journal never drains
+            log.warning("Journal not applied yet, will retry: %s", e)
+
+    def _apply_periodically(self):
+        self._apply()
+        while not self._stopped.wait(self._apply_interval):
+            self._apply()
+
+
+# ── Segmented archive ────────────────────────────────────────
+SEGMENT_FORMATS = {"daily": "%Y%m%d", "hourly": "%Y%m%d%H"}
+COMPRESSORS = {"gzip": (gzip.open, ".gz"), "lzma": (lzma.open, ".xz")}
+ARCHIVE_INDEX = "index.json"
+
+def load_archive_index(directory: str) -> dict:
+    """The archive's sidecar index: {segment file: {start, end, rows, offsets}}."""
+    try:
+        with open(os.path.join(directory, ARCHIVE_INDEX)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def open_segment(path: str):
+    """Open a segment for reading in binary mode, decompressing if need be."""
+    for opener, suffix in COMPRESSORS.values():
+        if path.endswith(suffix):
+            return opener(path, "rb")
+    return open(path, "rb")
+
+
+def scan_segment(path: str) -> dict:
+    """Build a segment's index entry by reading it through once."""
+    entry = {"start": None, "end": None, "rows": 0, "offsets": []}
+    with open_segment(path) as f:
+        offset = len(f.readline())
+        for line in f:
+            timestamp = line.split(b",", 1)[0].decode("utf-8")
+            if entry["rows"] % INDEX_EVERY == 0:
+                entry["offsets"].append([timestamp, offset])
+            entry["start"] = entry["start"] or timestamp
+            entry["end"] = timestamp
+            entry["rows"] += 1
+            offset += len(line)
+    return entry
+
+
+def read_archive(directory: str, start: datetime, end: datetime):
+    """
+    Lazily yield CSV rows (as lists, in CSV_HEADERS order) logged in [start, end).
+
+    Only segments whose indexed time range overlaps the window are opened,
+    and each is read from the last byte-offset mark before `start`.
+    Segments that are still being written are not indexed yet, so they are
+    simply scanned.
+    """
+    index = load_archive_index(directory)
+    live = sorted(name for name in os.listdir(directory) if name.endswith(".csv") and name not in index)
+
+    for name in sorted(index) + live:
+        entry = index.get(name)
+        offset = 0
+        if entry is not None:
+            if not entry["rows"] or datetime.fromisoformat(entry["end"]) < start \
+                    or datetime.fromisoformat(entry["start"]) >= end:
+                continue
+            for timestamp, mark in entry["offsets"]:
+                if datetime.fromisoformat(timestamp) > start:
+                    break
+                offset = mark
+
+        with open_segment(os.path.join(directory, name)) as f:
+            if offset:
+                f.seek(offset)
+            else:
+                f.readline()
+
+            for line in f:
+                row = line.decode("utf-8").rstrip("\n").split(",")
+                timestamp = datetime.fromisoformat(row[0])
+                if timestamp >= end:
+                    break
+                if timestamp >= start:
+                    yield row
+
+
+class ArchiveWriter(BatchWriter):
+    """
+    Sink that writes the CSV log as daily or hourly segments.
+
+    Each segment is a standalone CSV file with the usual headers. When the
+    period rolls over, the finished segment is compressed with gzip or lzma
+    in the background and its time range, row count and sparse byte offsets
+    are recorded in the sidecar index, so read_archive() only has to open
+    the segments a time window touches.
+    """
+
+    def __init__(self, path: str = ARCHIVE_DIR, period: str = SEGMENT_PERIOD,
+                 compression: str = ARCHIVE_COMPRESSION, **kwargs):
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.period_format = SEGMENT_FORMATS[period]
+        self.compression = compression
+
+        self._index = load_archive_index(path)
+        self._index_lock = threading.Lock()
+        self._compressing = []
+
+        # Anything left uncompressed by an earlier run is finished by now,
+        # apart from the segment for the current period, which we carry on
+        key = datetime.now(timezone.utc).strftime(self.period_format)
+        current = self._segment_name(key)
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".csv") and name != current:
+                self._close_segment(os.path.join(path, name), scan_segment(os.path.join(path, name)))
+        self._open_segment(key)
+
+        super().__init__(**kwargs)
+
+    def close(self):
+        super().close()
+        self._file.close()
+        for thread in self._compressing:
+            thread.join()
+
+    def _segment_name(self, key: str) -> str:
+        """Segment file for a period; a period archived already (after a clock change) gets a new part."""
+        name, part = f"access_log_{key}.csv", 0
+        while any(name + suffix in self._index for _, suffix in COMPRESSORS.values()):
+            part += 1
+            name = f"access_log_{key}.{part}.csv"
+        return name
+
+    def _open_segment(self, key: str):
+        segment = os.path.join(self.path, self._segment_name(key))
+        if os.path.exists(segment):
+            self._entry = scan_segment(segment)
+        else:
+            with open(segment, "w", newline="") as f:
+                csv.writer(f).writerow(CSV_HEADERS)
+            self._entry = {"start": None, "end": None, "rows": 0, "offsets": []}
+
+        self._key = key
+        self._file = open(segment, "ab")
+        self._offset = self._file.tell()
+
+    def _write_batch(self, events):
+        chunk = []
+        for received, uid, granted, device_millis, client_ip in events:
+            key = received.strftime(self.period_format)
+            if key > self._key:
+                self._write_chunk(chunk)
+                chunk = []
+                finished, entry = self._file.name, self._entry
+                self._file.close()
+                self._close_segment(finished, entry, background=True)
+                self._open_segment(key)
+
+            timestamp = received.isoformat()
+            line = f"{timestamp},{uid},{int(granted)},{device_millis},{client_ip}\n".encode("utf-8")
+
+            entry = self._entry
+            if entry["rows"] % INDEX_EVERY == 0:
+                entry["offsets"].append([timestamp, self._offset])
+            entry["start"] = entry["start"] or timestamp
+            entry["end"] = timestamp
+            entry["rows"] += 1
+
+            self._offset += len(line)
+            chunk.append(line)
+
+        self._write_chunk(chunk)
+
+    def _write_chunk(self, chunk: list[bytes]):
+        if not chunk:
+            return
+
+        self._file.write(b"".join(chunk))
+        self._file.flush()
+        if self.durability != "flush":
+            os.fsync(self._file.fileno())
+
+    def _close_segment(self, segment: str, entry: dict, background: bool = False):
+        if not entry["rows"]:
+            os.remove(segment)
+            return
+
+        if background:
+            thread = threading.Thread(target=self._compress, args=(segment, entry), daemon=True)
+            thread.start()
+            self._compressing = [t for t in self._compressing if t.is_alive()] + [thread]
+        else:
+            self._compress(segment, entry)
+
+    def _compress(self, segment: str, entry: dict):
+        """Compress a finished segment, then swap it for the compressed copy in the index."""
+        opener, suffix = COMPRESSORS[self.compression]
+        with open(segment, "rb") as source, opener(segment + suffix, "wb") as target:
+            shutil.copyfileobj(source, target)
+
+        with self._index_lock:
+            self._index[os.path.basename(segment) + suffix] = entry
+
+            index_path = os.path.join(self.path, ARCHIVE_INDEX)
+            with open(index_path + ".tmp", "w") as f:
+                json.dump(self._index, f)
+            os.replace(index_path + ".tmp", index_path)
+
+        os.remove(segment)
+        log.info("Archived '%s' (%d rows)", segment + suffix, entry["rows"])
+
+
+SINKS = {
+    "csv": LogWriter,
+    "sqlite": AccessLogWriter,
+    "journal": JournalWriter,
+    "archive": ArchiveWriter,
+}
+
+def open_sink(kind: str = "csv", path: str | None = None, durability: str = DURABILITY,
+              **options) -> BatchWriter:
+    """Open the named event sink, using its default path unless one is given."""
+    writer_class = SINKS[kind]
+    if path is None:
+        return writer_class(durability=durability, **options)
+    return writer_class(path, durability=durability, **options)
+
+
+class DetectingWriter(BatchWriter):
+    """
+    Wraps another sink and runs each batch it writes through an
+    anomaly.AnomalyDetector, storing any alerts via an anomaly.AlertStore.
+    A batch is only checked once the inner sink has written it, so a
+    retried batch isn't checked twice.
+    """
+
+    def __init__(self, inner: BatchWriter, detector, store, **kwargs):
+        self.inner = inner
+        self.detector = detector
+        self.store = store
+        self.path = inner.path
+        super().__init__(**kwargs)
+
+    def close(self):
+        super().close()
+        self.inner.close()
+        self.store.close()
+
+    def _write_batch(self, events):
+        self.inner._write_batch(events)
+        self.store.write(self.detector.observe_events(events))
 
 
 # ── Packet parsing ───────────────────────────────────────────
@@ -58,59 +924,654 @@ def parse_payload(raw: str) -> tuple[str, bool, str] | None:
     return uid, granted_str == "1", millis
 
 
+# ── Binary frames ────────────────────────────────────────────
+# Optional fixed-layout alternative to the CSV line, all fields big-endian:
+#   magic      uint8    FRAME_MAGIC, which can never start a UTF-8 CSV line
+#   length     uint8    bytes in the body that follows (>= FRAME_BODY.size)
+#   uid_len    uint8    number of UID bytes actually used
+#   uid        10 bytes raw UID, zero padded
+#   granted    uint8    1 (access granted) or 0 (access denied)
+#   millis     uint32   milliseconds since the reader last booted
+#   device_id  uint16   reader's provisioned id
+# Newer firmware may append fields to the body; the length lets us skip them.
+FRAME_MAGIC  = 0xA5
+MAX_UID_LEN  = 10
+FRAME_HEADER = struct.Struct("!BB")
+FRAME_BODY   = struct.Struct(f"!B{MAX_UID_LEN}sBIH")
+FRAME        = struct.Struct(f"!BBB{MAX_UID_LEN}sBIH")   # Header and body in one
+
+def encode_frame(uid: str, granted: bool, millis: int, device_id: int) -> bytes:
+    """Build a binary frame, as the firmware does. `uid` is a hex string."""
+    uid_bytes = bytes.fromhex(uid)
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_BODY.size) + FRAME_BODY.pack(
+        len(uid_bytes), uid_bytes, int(granted), millis, device_id
+    )
+
+
+def decode_frame(buffer, offset: int = 0) -> tuple[str, bool, str, int] | None:
+    """
+    Decode the binary frame starting at `offset` straight out of `buffer`.
+    Returns (uid, granted, millis, device_id) or None if malformed.
+    """
+    if buffer[offset] != FRAME_MAGIC or buffer[offset + 1] < FRAME_BODY.size:
+        return None
+
+    _, _, uid_len, uid_bytes, granted, millis, device_id = FRAME.unpack_from(buffer, offset)
+    if not 0 < uid_len <= MAX_UID_LEN or granted > 1:
+        return None
+
+    return uid_bytes[:uid_len].hex().upper(), granted == 1, str(millis), device_id
+
+
+# ── Stream framing ───────────────────────────────────────────
+class EventFramer:
+    """
+    Splits a reader's byte stream into events.
+
+    Received bytes land in one bytearray that is compacted in place, so an
+    event split across reads is reassembled and several events coalesced
+    into one read are all seen. Each event is either a newline-terminated
+    CSV line, returned as bytes, or a binary frame, recognised by its
+    FRAME_MAGIC byte and decoded in place into a tuple (None if malformed).
+    Blank lines are skipped.
+    """
+
+    def __init__(self, max_line: int = BUFFER_SIZE):
+        self.buffer = bytearray()
+        self.max_line = max_line
+
+    def feed(self, data) -> list:
+        """Add received bytes and return every complete event now available."""
+        buffer = self.buffer
+        buffer += data
+        size = len(buffer)
+
+        events = []
+        start = 0
+        while start < size:
+            if buffer[start] == FRAME_MAGIC:
+                if size - start < FRAME_HEADER.size:
+                    break
+                end = start + FRAME_HEADER.size + buffer[start + 1]
+                if end > size:
+                    break
+                events.append(decode_frame(buffer, start))
+                start = end
+            else:
+                end = buffer.find(b"\n", start)
+                if end == -1:
+                    break
+                if end > start:
+                    events.append(bytes(buffer[start:end]))
+                start = end + 1
+        del buffer[:start]
+
+        if len(buffer) > self.max_line:
+            # No newline in sight - hand it on as one (malformed) line rather than grow forever
+            events.append(bytes(buffer))
+            buffer.clear()
+
+        return events
+
+    def finish(self) -> list:
+        """Return whatever is left when the reader closes without a trailing newline."""
+        events = [bytes(self.buffer)] if self.buffer.strip() else []
+        self.buffer.clear()
+        return events
+
+
+def handle_event(event, client_ip: str, sink: BatchWriter) -> int | None:
+    """Parse one framed event and queue it. Returns its position on sink, or None if it was rejected."""
+    started = time.perf_counter()
+
+    if event is None:
+        log.warning("Malformed binary frame from %s", client_ip)
+        return None
+
+    if isinstance(event, bytes):
+        try:
+            raw_data = event.decode("utf-8")
+        except UnicodeDecodeError:
+            log.warning("Non-UTF-8 data from %s — ignoring", client_ip)
+            return None
+
+        parsed = parse_payload(raw_data)
+        if parsed is None:
+            log.warning("Malformed payload from %s: %r", client_ip, raw_data.strip())
+            return None
+    else:
+        parsed = event[:3]
+
+    uid, granted, millis = parsed
+    parsed_at = time.perf_counter()
+    METRICS.observe("parse", parsed_at - started)
+    log.debug("Event from %s: UID=%r Status=%s Uptime=%sms",
+              client_ip, uid, "GRANTED" if granted else "DENIED", millis)
+
+    position = sink.write(uid, granted, millis, client_ip)
+    METRICS.observe("write", time.perf_counter() - parsed_at)
+    return position
+
+
+def handle_events(events: list, seq: int, client_ip: str, sink: BatchWriter) -> tuple[int, bytes, int]:
+    """
+    Handle a run of framed events from one connection.
+    Returns the last sequence number used, the acks to send back (one
+    "ACK <seq>" or "NAK <seq>" line per event, in order) and the sink
+    position they must wait for: an ACK promises the event was logged,
+    so none may go out before sink.written reaches it (0: nothing to wait for).
+    """
+    acks = bytearray()
+    accepted = 0
+    last = 0
+    for event in events:
+        seq += 1
+        position = handle_event(event, client_ip, sink)
+        if position is not None:
+            accepted += 1
+            last = position
+            acks += b"ACK %d\n" % seq
+        else:
+            acks += b"NAK %d\n" % seq
+
+    if accepted:
+        METRICS.count("events_total", accepted, result="accepted")
+        METRICS.count("device_events_total", accepted, client_ip=client_ip, result="accepted")
+    if accepted < len(events):
+        METRICS.count("events_total", len(events) - accepted, result="rejected")
+        METRICS.count("device_events_total", len(events) - accepted, client_ip=client_ip, result="rejected")
+    return seq, bytes(acks), last
+
+
+async def events_written(sink: BatchWriter, position: int) -> bool:
+    """Wait, without blocking the event loop, until sink has written position. False after ACK_TIMEOUT."""
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def wake():
+        if not done.done():
+            done.set_result(None)
+
+    sink.when_written(position, lambda: loop.call_soon_threadsafe(wake))
+    try:
+        await asyncio.wait_for(done, ACK_TIMEOUT)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+def unacked(client_ip: str, position: int):
+    """Note a reader dropped because its events weren't written in time."""
+    log.warning("Events from %s not written within %ss (position %d) — closing without acking",
+                client_ip, ACK_TIMEOUT, position)
+    METRICS.count("ack_timeouts_total")
+
+
+def received(nbytes: int, client_ip: str):
+    """Count bytes received from a reader."""
+    METRICS.count("bytes_received_total", nbytes)
+    METRICS.count("device_bytes_received_total", nbytes, client_ip=client_ip)
+
+
+def connected(client_ip: str, accepted_at: float):
+    """Note a new reader connection once its handler is ready for it."""
+    METRICS.observe("accept", time.perf_counter() - accepted_at)
+    METRICS.count("connections_total")
+    METRICS.count("device_connections_total", client_ip=client_ip)
+    log.debug("Connection from %s", client_ip)
+
+
 # ── Main server loop ─────────────────────────────────────────
-def run_server():
-    initialise_log()
+def run_server(sink: BatchWriter):
 
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((HOST, PORT))
-    server_socket.listen(5)
+    server_socket.listen(LISTEN_BACKLOG)
+
+    log.info("Listening on %s:%d", HOST, PORT)
+    log.info("Logging to '%s'", sink.path)
+    log.info("Press Ctrl+C to stop.")
 
-    print(f"[SERVER] Listening on {HOST}:{PORT}")
-    print(f"[SERVER] Logging to '{LOG_FILE}'")
-    print("[SERVER] Press Ctrl+C to stop.\n")
+    recv_buffer = bytearray(BUFFER_SIZE)
+    recv_view = memoryview(recv_buffer)
 
     try:
         while True:
             client_socket, address = server_socket.accept()
+            accepted_at = time.perf_counter()
             client_ip = address[0]
-            print(f"[CONNECT] Connection from {client_ip}")
+
+            # Only one reader is served at a time here, so a keep-alive reader
+            # waiting for its next scan would hold up every other door: the
+            # connection is closed after its first burst of events (the reader
+            # reconnects for the next), or after READ_TIMEOUT with none
+            client_socket.settimeout(READ_TIMEOUT)
+            framer = EventFramer()
+            seq = 0
+            connected(client_ip, accepted_at)
 
             try:
-                raw_data = client_socket.recv(BUFFER_SIZE).decode("utf-8")
-            except UnicodeDecodeError:
-                print(f"[WARN] Non-UTF-8 data from {client_ip} — ignoring")
-                client_socket.close()
-                continue
+                while True:
+                    nbytes = client_socket.recv_into(recv_buffer)
+                    framing = time.perf_counter()
+                    events = framer.feed(recv_view[:nbytes]) if nbytes else framer.finish()
+                    METRICS.observe("recv", time.perf_counter() - framing)
+                    received(nbytes, client_ip)
+
+                    seq, acks, position = handle_events(events, seq, client_ip, sink)
+                    if position:
+                        # Nobody else can add to the batch while this reader is served, so write it now
+                        waiting = time.perf_counter()
+                        sink.flush()
+                        if not sink.wait_written(position, ACK_TIMEOUT):
+                            unacked(client_ip, position)
+                            break
+                        METRICS.observe("ack", time.perf_counter() - waiting)
+                    if acks:
+                        client_socket.sendall(acks)
 
-            if not raw_data:
-                print(f"[WARN] Empty payload from {client_ip}")
+                    if events or not nbytes:
+                        break
+            except socket.timeout:
+                log.debug("%s idle for %ss — closing", client_ip, READ_TIMEOUT)
+                METRICS.count("timeouts_total")
+            except OSError as e:
+                log.warning("Connection error from %s: %s", client_ip, e)
+                METRICS.count("connection_errors_total")
+            finally:
+                closing = time.perf_counter()
                 client_socket.close()
-                continue
+                METRICS.observe("close", time.perf_counter() - closing)
 
-            print(f"[RECV] {raw_data.strip()!r}")
+            if seq == 0:
+                log.warning("Empty payload from %s", client_ip)
 
-            parsed = parse_payload(raw_data)
-            if parsed is None:
-                print(f"[WARN] Malformed payload from {client_ip}: {raw_data.strip()!r}")
-                client_socket.close()
-                continue
+    except KeyboardInterrupt:
+        log.info("Shutting down gracefully...")
+    finally:
+        server_socket.close()
+        log.info("Socket closed.")
+        sink.close()
+        log.info("Flushed '%s'.", sink.path)
+
+
+# ── Async server (event loop) ────────────────────────────────
+async def handle_reader(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        slots: asyncio.Semaphore, sink: BatchWriter):
+    """
+    Serve one reader connection on the event loop.
+
+    A reader may send one event and close, or keep the connection open and
+    stream many newline-terminated events, each answered with an ack. A
+    reader stalled mid-event is dropped after READ_TIMEOUT, an idle
+    keep-alive reader after IDLE_TIMEOUT.
+    """
+    accepted_at = time.perf_counter()
+    client_ip = writer.get_extra_info("peername")[0]
+
+    async with slots:
+        connected(client_ip, accepted_at)
+
+        framer = EventFramer()
+        seq = 0
 
-            uid, granted, millis = parsed
-            print(f"[EVENT] UID={uid!r}  Status={'GRANTED' if granted else 'DENIED'}  Uptime={millis}ms")
+        try:
+            while True:
+                timeout = READ_TIMEOUT if framer.buffer else IDLE_TIMEOUT
+                data = await asyncio.wait_for(reader.read(BUFFER_SIZE), timeout)
 
-            log_event(uid, granted, millis, client_ip)
-            print(f"[LOG]   Written to {LOG_FILE}\n")
+                framing = time.perf_counter()
+                events = framer.feed(data) if data else framer.finish()
+                METRICS.observe("recv", time.perf_counter() - framing)
+                received(len(data), client_ip)
 
-            client_socket.close()
+                seq, acks, position = handle_events(events, seq, client_ip, sink)
+                if position:
+                    # Acked together with every other reader whose events share the batch
+                    waiting = time.perf_counter()
+                    if not await events_written(sink, position):
+                        unacked(client_ip, position)
+                        break
+                    METRICS.observe("ack", time.perf_counter() - waiting)
+                if acks:
+                    writer.write(acks)
+                    await writer.drain()
 
+                if not data:
+                    break
+        except asyncio.TimeoutError:
+            log.debug("%s timed out — closing", client_ip)
+            METRICS.count("timeouts_total")
+        except ConnectionError as e:
+            log.warning("Connection error from %s: %s", client_ip, e)
+            METRICS.count("connection_errors_total")
+
+        if seq == 0:
+            log.warning("Empty payload from %s", client_ip)
+
+        closing = time.perf_counter()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+        METRICS.observe("close", time.perf_counter() - closing)
+
+
+async def start_async_server(sink: BatchWriter, host: str = HOST, port: int = PORT,
+                             sock: socket.socket | None = None) -> asyncio.Server:
+    """
+    Start the event-loop ingest server and return it.
+    Pass an already-bound `sock` to serve on a socket created elsewhere.
+    """
+    slots = asyncio.Semaphore(MAX_CONNECTIONS)
+
+    async def on_connect(reader, writer):
+        await handle_reader(reader, writer, slots, sink)
+
+    if sock is not None:
+        return await asyncio.start_server(on_connect, sock=sock, backlog=LISTEN_BACKLOG)
+
+    return await asyncio.start_server(
+        on_connect, host, port, reuse_address=True, backlog=LISTEN_BACKLOG
+    )
+
+
+def run_async_server(sink: BatchWriter):
+    async def serve():
+        server = await start_async_server(sink)
+        log.info("Listening on %s:%d (async, up to %d readers)", HOST, PORT, MAX_CONNECTIONS)
+        log.info("Logging to '%s'", sink.path)
+        log.info("Press Ctrl+C to stop.")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
     except KeyboardInterrupt:
-        print("\n[SERVER] Shutting down gracefully...")
+        log.info("Shutting down gracefully...")
     finally:
-        server_socket.close()
-        print("[SERVER] Socket closed.")
+        log.info("Socket closed.")
+        sink.close()
+        log.info("Flushed '%s'.", sink.path)
+
+
+# ── Supervisor (multi-core) ──────────────────────────────────
+class QueueWriter(BatchWriter):
+    """
+    Worker-side sink that hands batches to the supervisor's writer stage.
+    Handing them over isn't writing them: the writer stage sends back how
+    far this worker's events have really been written, on `confirmations`,
+    and only that moves `written` on.
+    """
+
+    confirms_on_write = False
+
+    def __init__(self, queue: multiprocessing.Queue, confirmations: multiprocessing.Queue, worker: int, **kwargs):
+        self.path = "writer stage"
+        self._queue = queue
+        self._confirmations = confirmations
+        self._worker = worker
+        super().__init__(flush_events=QUEUE_BATCH, **kwargs)
+
+        self._confirming = threading.Thread(target=self._read_confirmations, daemon=True)
+        self._confirming.start()
+
+    def _write_batch(self, events):
+        # The queue pickles in the background, so it needs its own copy
+        self._queue.put((self._worker, self.queued, list(events)))
+
+    def _read_confirmations(self):
+        while (position := self._confirmations.get()) is not None:
+            self.confirm(position)
+
+
+def reuseport_socket(host: str, port: int) -> socket.socket:
+    """A listening socket that other processes can bind to the same port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+
+def run_worker(queue: multiprocessing.Queue, confirmations: multiprocessing.Queue, worker: int,
+               host: str, port: int, metrics_port: int = 0):
+    """Worker process: parse and batch events on its own event loop until SIGTERM."""
+    # Ctrl+C is for the supervisor; it stops us with SIGTERM once it is ready
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Counters inherited from the supervisor are not ours
+    global METRICS
+    METRICS = Metrics()
+    if metrics_port:
+        start_metrics_server(metrics_port)
+
+    sink = QueueWriter(queue, confirmations, worker)
+
+    async def serve():
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+
+        server = await start_async_server(sink, sock=reuseport_socket(host, port))
+        await stop.wait()
+        server.close()
+
+        # Give readers part-way through an event a chance to finish, then drop the rest
+        handlers = asyncio.all_tasks() - {asyncio.current_task()}
+        if handlers:
+            _, unfinished = await asyncio.wait(handlers, timeout=READ_TIMEOUT)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+    try:
+        asyncio.run(serve())
+    finally:
+        sink.close()
+
+
+class Supervisor:
+    """
+    Runs `workers` ingest processes that share one listening port through
+    SO_REUSEPORT, so the kernel spreads readers across cores. Workers pass
+    parsed batches over a multiprocessing queue to a single writer thread
+    here, which owns the real sink, and are told on a queue of their own
+    once their events are written, so they can ack them. A worker that
+    dies is replaced, and the other workers keep serving their doors
+    meanwhile.
+
+    With a metrics_port, worker i serves its own metrics on metrics_port + 1 + i.
+    """
+
+    def __init__(self, sink: BatchWriter, workers: int = WORKERS, host: str = HOST, port: int = PORT,
+                 metrics_port: int = 0):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("Supervisor mode needs SO_REUSEPORT, which this platform does not have")
+
+        self.sink = sink
+        self.host = host
+        self.port = port
+        self.metrics_port = metrics_port
+        self.queue = multiprocessing.Queue(QUEUE_MAX)
+        self.workers = [None] * workers
+        self.worker_ids = [None] * workers
+        self.confirmations = {}     # Worker id -> its confirmation queue, while it runs
+        self._spawned = 0
+        self._writer = threading.Thread(target=self._drain_queue, daemon=True)
+
+    def start(self):
+        self._writer.start()
+        for index in range(len(self.workers)):
+            self._spawn(index)
+
+    def check_workers(self):
+        """Replace any worker that has died."""
+        for index, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                log.warning("Worker %d (pid %d) exited with code %s — restarting", index, worker.pid, worker.exitcode)
+                METRICS.count("worker_restarts_total")
+                # Its events still queued get written, but there's nobody left to ack them to
+                self.confirmations.pop(self.worker_ids[index], None)
+                self._spawn(index)
+
+    def stop(self):
+        """Stop the workers, then let the writer stage drain what they sent."""
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+
+        self.queue.put(None)
+        self._writer.join()
+
+    def _spawn(self, index: int):
+        # Ids aren't reused, so a replacement is never acked for its predecessor's events
+        self._spawned += 1
+        confirmations = multiprocessing.Queue()
+        worker = multiprocessing.Process(
+            target=run_worker,
+            args=(self.queue, confirmations, self._spawned, self.host, self.port,
+                  self.metrics_port and self.metrics_port + 1 + index),
+            name=f"ingest-worker-{index}", daemon=True
+        )
+        self.confirmations[self._spawned] = confirmations
+        worker.start()
+        self.workers[index] = worker
+        self.worker_ids[index] = self._spawned
+
+    def _drain_queue(self):
+        while (batch := self.queue.get()) is not None:
+            worker, worker_position, events = batch
+            position = self.sink.write_events(events)
+            self.sink.when_written(position, lambda worker=worker, done=worker_position: self._confirm(worker, done))
+
+    def _confirm(self, worker: int, position: int):
+        confirmations = self.confirmations.get(worker)
+        if confirmations is not None:
+            confirmations.put(position)
+
+
+def run_supervisor(sink: BatchWriter, workers: int = WORKERS, metrics_port: int = 0):
+    supervisor = Supervisor(sink, workers, metrics_port=metrics_port)
+    supervisor.start()
+
+    log.info("Listening on %s:%d (%d workers)", HOST, PORT, workers)
+    log.info("Logging to '%s'", sink.path)
+    log.info("Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            time.sleep(RESTART_DELAY)
+            supervisor.check_workers()
+    except KeyboardInterrupt:
+        log.info("Shutting down gracefully...")
+    finally:
+        supervisor.stop()
+        log.info("Workers stopped.")
+        sink.close()
+        log.info("Flushed '%s'.", sink.path)
 
 
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description="ESP32 access event ingest server")
+    parser.add_argument(
+        "--mode", choices=("blocking", "async", "supervisor"), default="blocking",
+        help="'blocking' serves one reader at a time (one burst of events per connection), "
+             "'async' serves many on one event loop, "
+             "'supervisor' runs several async workers on one port"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS,
+        help="Worker processes in supervisor mode (default: one per core)"
+    )
+    parser.add_argument(
+        "--durability", choices=DURABILITY_MODES, default=DURABILITY,
+        help="When to sync the log to disk: never ('flush'), once per batch, or after every event"
+    )
+    parser.add_argument(
+        "--sink", choices=tuple(SINKS), default="csv",
+        help="Write events to the CSV log, straight into the flaskr accessLog table, "
+             "to a write-ahead journal that is applied to accessLog in the background, "
+             "or to a CSV log archived in compressed daily/hourly segments"
+    )
+    parser.add_argument(
+        "--path", default=None,
+        help=f"CSV file, SQLite database, journal directory or archive directory to write to "
+             f"(default '{LOG_FILE}', '{DATABASE}', '{JOURNAL_DIR}' or '{ARCHIVE_DIR}')"
+    )
+    parser.add_argument(
+        "--segment-period", choices=tuple(SEGMENT_FORMATS), default=SEGMENT_PERIOD,
+        help="How much of the archive goes in each segment"
+    )
+    parser.add_argument(
+        "--compression", choices=tuple(COMPRESSORS), default=ARCHIVE_COMPRESSION,
+        help="How closed archive segments are compressed"
+    )
+    parser.add_argument(
+        "--read-archive", nargs=2, metavar=("START", "END"), default=None,
+        help="Print the archived rows logged between two ISO dates/times (UTC), then exit"
+    )
+    parser.add_argument(
+        "--database", default=DATABASE,
+        help="Database the journal is applied to, and alerts are written to with --detect"
+    )
+    parser.add_argument(
+        "--detect", action="store_true",
+        help="Check events for unusual access as they arrive and write alerts to the database (see anomaly.py)"
+    )
+    parser.add_argument(
+        "--apply-journal", action="store_true",
+        help="Apply whatever is left in the journal to the database, then exit"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=METRICS_PORT,
+        help=f"Serve Prometheus metrics on http://{METRICS_HOST}:<port>/metrics (0 to disable)"
+    )
+    parser.add_argument(
+        "--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="INFO",
+        help="DEBUG logs every connection and event"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=args.log_level,
+        format="%(asctime)s %(levelname)-7s %(processName)s %(message)s"
+    )
+
+    if args.apply_journal:
+        applier = JournalApplier(args.path or JOURNAL_DIR, args.database)
+        log.info("Applied %d journal events to '%s'", applier.apply(), args.database)
+        applier.close()
+        raise SystemExit
+
+    if args.read_archive:
+        start, end = (datetime.fromisoformat(moment).replace(tzinfo=timezone.utc) for moment in args.read_archive)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(CSV_HEADERS)
+        writer.writerows(read_archive(args.path or ARCHIVE_DIR, start, end))
+        raise SystemExit
+
+    options = {}
+    if args.sink == "journal":
+        options = {"database": args.database}
+    elif args.sink == "archive":
+        options = {"period": args.segment_period, "compression": args.compression}
+    sink = open_sink(args.sink, args.path, args.durability, **options)
+    if args.detect:
+        import anomaly
+
+        store = anomaly.AlertStore(args.database)
+        sink = DetectingWriter(sink, anomaly.AnomalyDetector(store.known_uids), store, durability=args.durability)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    if args.mode == "supervisor":
+        run_supervisor(sink, args.workers, args.metrics_port)
+    elif args.mode == "async":
+        run_async_server(sink)
+    else:
+        run_server(sink)
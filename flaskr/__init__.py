@@ -1,9 +1,12 @@
 # Define the __all__ variable
-__all__ = ["auth", "db", "plotting", "querying", "app"]
+__all__ = ["aggregation", "auth", "charts", "db", "partitions", "plotting", "querying", "app"]
 
 # Import the submodules
+from . import aggregation
 from . import auth
+from . import charts
 from . import db
+from . import partitions
 from . import plotting
 from . import querying
 from . import user
@@ -20,7 +23,39 @@ def create_app(test_conf=None):
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY='290125',
-        DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite')
+        DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        # Applied once to every pooled connection (see db.ConnectionPool)
+        SQLITE_PRAGMAS={
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -16000,               # KiB, so ~16MB per connection
+            'mmap_size': 64 * 1024 * 1024,
+            'temp_store': 'MEMORY',
+            'busy_timeout': 5000,               # ms, esp32.py writes alongside us
+        },
+        SQLITE_POOL_SIZE=4,                     # Idle connections kept open
+        # Closed months of accessLog, moved out by `flask partition-log`
+        PARTITION_DIR=os.path.join(app.instance_path, 'partitions'),
+        ACCESS_LOG_RETENTION_MONTHS=None,       # Keep partitions forever
+        ACCESS_LOG_VIEW_MONTHS=6,               # Newest partitions the console's accessLogAll includes (at most 10)
+        # Rendered dashboards kept per process, and on disk if a directory is set
+        DASHBOARD_CACHE_SIZE=8,
+        DASHBOARD_CACHE_DIR=None,
+        # Server-side chart rendering (charts.py)
+        CHART_WORKERS=2,                        # Renders at once
+        CHART_MAX_PENDING=8,                    # Renders running or queued before answering 503
+        CHART_RENDER_TIMEOUT=30,                # Seconds a request waits for its render
+        CHART_MAX_AGE=10,                       # Seconds clients may reuse a chart before asking again
+        CHART_MAX_DAYS=366,                     # Longest start to end range a chart may cover
+        # SQL console (querying.py)
+        QUERY_CHUNK_ROWS=1000,                  # Rows fetched from SQLite at a time
+        QUERY_PAGE_SIZE=500,                    # Rows shown per page of results
+        QUERY_CACHE_SIZE=64,                    # Query results kept per process...
+        QUERY_CACHE_BYTES=64 * 1024 * 1024,     # ...as long as they come to no more than this
+        QUERY_TIMEOUT=30,                       # Seconds a query may run before it is stopped
+        QUERY_MAX_ROWS=1_000_000,               # Rows a query may read out, pages skipped over included
+        SLOW_QUERY_MS=500,                      # Queries taking this long are logged...
+        SLOW_QUERY_LOG=os.path.join(app.instance_path, 'slow_queries.sqlite')    # ...here (`flask slow-queries`)
     )
 
     if test_conf is None:
@@ -36,8 +71,11 @@ def create_app(test_conf=None):
         pass
     
     db.init_app(app)
+    partitions.init_app(app)
+    querying.init_app(app)
     app.register_blueprint(auth.bp)
     app.register_blueprint(user.bp)
+    app.register_blueprint(charts.bp)
 
     #CORS(app)   # Enable CORS
     return app
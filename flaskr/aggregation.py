@@ -0,0 +1,121 @@
+"""
+Per-department access counts for the dashboard.
+
+One indexed query reads the accessDaily rollup for the span covering this
+quarter and this week. A single numpy bincount then turns it into a
+(department x day) grid, and today, this week, this quarter and the daily
+average are slices of that grid.
+"""
+import datetime
+
+import numpy as np
+
+from flaskr.db import get_db
+
+
+DEPARTMENTS_QUERY = "SELECT department_id, department_name FROM departments ORDER BY department_id"
+
+# Rows of (department, days since :start, authorised, count), straight off accessDaily's primary key
+DAILY_COUNTS_QUERY = """
+    SELECT department_id, CAST(julianday(day) - julianday(:start) AS INTEGER), is_authorised, accesses
+    FROM accessDaily
+    WHERE day >= :start AND day < :end
+"""
+
+
+def quarter_bounds(today):
+    """ First day of today's quarter and of the next one """
+    start_month = (today.month - 1) // 3 * 3 + 1
+    start = datetime.date(today.year, start_month, 1)
+    if start_month == 10:
+        end = datetime.date(today.year + 1, 1, 1)
+    else:
+        end = datetime.date(today.year, start_month + 3, 1)
+    return start, end
+
+
+def week_bounds(today):
+    """ Monday of today's week and of the next one """
+    start = today - datetime.timedelta(days=today.weekday())
+    return start, start + datetime.timedelta(days=7)
+
+
+def department_counts(app, authorised=True, today=None):
+    """
+    Access counts per department, in departments table order.
+
+    authorised picks granted (True) or denied (False) scans, or both (None).
+    today defaults to the current UTC date, which is what accessed is in.
+    Returns a dict of 'departments' (names), 'department_ids' and numpy
+    arrays 'today', 'week', 'quarter' and 'per_day' (the quarter's average
+    per day so far).
+    """
+    with app.app_context():
+        return count_departments(get_db(), authorised, today)
+
+
+def count_departments(db, authorised=True, today=None):
+    """ department_counts() on a connection of the caller's, e.g. inside its own read transaction """
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    quarter_start, quarter_end = quarter_bounds(today)
+    week_start, week_end = week_bounds(today)
+
+    # A week can start in the previous quarter or end in the next one
+    start = min(quarter_start, week_start)
+    end = max(quarter_end, week_end)
+    names, ids, grid = daily_grid(db, start, end, authorised)
+
+    def total(first, last):
+        return grid[:, (first - start).days:(last - start).days].sum(axis=1)
+
+    quarter = total(quarter_start, quarter_end)
+    return {
+        'departments': names,
+        'department_ids': ids,
+        'today': grid[:, (today - start).days],
+        'week': total(week_start, week_end),
+        'quarter': quarter,
+        'per_day': quarter / ((today - quarter_start).days + 1),
+    }
+
+
+def department_totals(app, start, end, authorised=True):
+    """ Accesses per department over the dates start <= day < end: (names, numpy array) """
+    with app.app_context():
+        names, _, grid = daily_grid(get_db(), start, end, authorised)
+    return names, grid.sum(axis=1)
+
+
+def daily_grid(db, start, end, authorised=True):
+    """
+    The bincount pass: (names, department_ids, grid) where grid[bar, day] is
+    the accesses of the bar'th department on the day'th day from start.
+    """
+    days = (end - start).days
+    departments = db.execute(DEPARTMENTS_QUERY).fetchall()
+
+    cursor = db.cursor()
+    cursor.row_factory = None       # Plain tuples go straight into numpy
+    rows = cursor.execute(DAILY_COUNTS_QUERY, {'start': start.isoformat(), 'end': end.isoformat()}).fetchall()
+
+    ids = np.array([department['department_id'] for department in departments], dtype=np.int64)
+    names = [department['department_name'] for department in departments]
+
+    department, offset, status, accesses = np.array(rows, dtype=np.int64).reshape(-1, 4).T
+
+    # department_id -> bar, or -1 for cards nobody owns (department 0)
+    bar_of = np.full(max(ids.max(initial=0), department.max(initial=0)) + 1, -1)
+    bar_of[ids] = np.arange(len(ids))
+    bar = bar_of[department]
+
+    wanted = bar >= 0
+    if authorised is not None:
+        wanted &= status == int(authorised)
+
+    grid = np.bincount(
+        bar[wanted] * days + offset[wanted],
+        weights=accesses[wanted],
+        minlength=len(ids) * days
+    ).astype(np.int64).reshape(len(ids), days)
+
+    return names, ids, grid
@@ -0,0 +1,156 @@
+"""
+Charts rendered on the server, so consoles and wall displays can share one
+render instead of each running the queries and matplotlib themselves.
+
+    GET /charts/dashboard.png                       The Home tab's four charts
+    GET /charts/departments.svg?start=2026-10-01&end=2026-10-18&status=denied
+
+start/end are UTC dates (end exclusive, default: this quarter, at most
+CHART_MAX_DAYS apart) and status is authorised (default), denied or all.
+Renders run on a small bounded pool; identical requests in flight share
+one render. Responses carry an ETag that changes only when the data drawn
+does, so repeat requests for an unchanged chart get a 304 without any
+queries.
+"""
+import datetime
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from flaskr import aggregation, plotting
+from flaskr.cache import LRUCache
+from flaskr.db import data_version
+
+bp = Blueprint('charts', __name__, url_prefix='/charts')
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+STATUSES = {
+    'authorised': True,
+    'denied': False,
+    'all': None,
+}
+
+
+class RenderPool:
+    """
+    A ThreadPoolExecutor that refuses work beyond max_pending renders
+    (running or queued), and runs only one render per key at a time; later
+    requests for the same key wait for that one.
+    """
+
+    def __init__(self, workers, max_pending):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chart')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.RLock()      # Done callbacks can run inside render()
+        self._in_flight = {}
+
+    def render(self, key, build, timeout):
+        """ build()'s result, or None if the pool is full or the render takes longer than timeout """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                if not self._slots.acquire(blocking=False):
+                    return None
+                future = self._executor.submit(build)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda _: self._finished(key))
+
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            return None
+
+    def _finished(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        self._slots.release()
+
+
+def _state(app):
+    state = app.extensions.get('charts')
+    if state is None:
+        state = app.extensions['charts'] = {
+            'pool': RenderPool(app.config['CHART_WORKERS'], app.config['CHART_MAX_PENDING']),
+            'totals': LRUCache(64),
+            'images': LRUCache(app.config['DASHBOARD_CACHE_SIZE']),
+        }
+    return state
+
+
+def _image_response(app, etag, fmt, key, build):
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'public, max-age={app.config["CHART_MAX_AGE"]}',
+    }
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    state = _state(app)
+    image = state['images'].get(key)
+    if image is None:
+        image = state['pool'].render(key, build, app.config['CHART_RENDER_TIMEOUT'])
+        if image is None:
+            response = jsonify({"error": "Too many charts being drawn, try again shortly"})
+            response.status_code = 503
+            response.headers['Retry-After'] = '1'
+            return response
+        state['images'].put(key, image)
+
+    return Response(image, mimetype=FORMATS[fmt], headers=headers)
+
+
+@bp.route('/dashboard.<fmt>')
+def dashboard(fmt):
+    if fmt not in FORMATS:
+        return jsonify({"error": f"Unknown format {fmt!r}, use png or svg"}), 404
+
+    app = current_app._get_current_object()
+    digest = plotting.dashboard_digest(app)
+    return _image_response(
+        app, f'dashboard-{digest}-{fmt}', fmt, ('dashboard', digest, fmt),
+        lambda: plotting.dashboard_image(app, fmt)
+    )
+
+
+@bp.route('/departments.<fmt>')
+def departments(fmt):
+    if fmt not in FORMATS:
+        return jsonify({"error": f"Unknown format {fmt!r}, use png or svg"}), 404
+
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    quarter_start, quarter_end = aggregation.quarter_bounds(today)
+    try:
+        start = datetime.date.fromisoformat(request.args.get('start', quarter_start.isoformat()))
+        end = datetime.date.fromisoformat(request.args.get('end', quarter_end.isoformat()))
+    except ValueError:
+        return jsonify({"error": "start and end must be dates, e.g. 2026-10-01"}), 400
+    if end <= start:
+        return jsonify({"error": "end must be after start"}), 400
+    max_days = current_app.config['CHART_MAX_DAYS']
+    if (end - start).days > max_days:
+        return jsonify({"error": f"start to end can be at most {max_days} days"}), 400
+
+    status = request.args.get('status', 'authorised')
+    if status not in STATUSES:
+        return jsonify({"error": "status must be authorised, denied or all"}), 400
+
+    app = current_app._get_current_object()
+
+    # The totals only get queried again once the data has changed
+    names, totals = _state(app)['totals'].get_or_build(
+        (data_version(app), start, end, status),
+        lambda: aggregation.department_totals(app, start, end, STATUSES[status])
+    )
+
+    title = f'{status.title()} accesses, {start} to {end - datetime.timedelta(days=1)}'
+    digest = hashlib.sha1(totals.tobytes() + '\0'.join(names + [title]).encode('utf-8')).hexdigest()
+    return _image_response(
+        app, f'departments-{digest}-{fmt}', fmt, ('departments', digest, fmt),
+        lambda: plotting.render_figure(plotting.DepartmentBarchart(names, totals, title, 'Accesses'), fmt)
+    )
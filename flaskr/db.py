@@ -1,39 +1,544 @@
+import os
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timezone
 
 import click
 from flask import current_app, g
 
+
+def apply_pragmas(db, pragmas):
+    for name, value in pragmas.items():
+        db.execute(f"PRAGMA {name} = {value}")
+
+
+class ConnectionPool:
+    """
+    Keeps SQLite connections open between app contexts.
+
+    Each thread gets a connection of its own for as long as its app context
+    lives. When the context ends the connection goes back on the idle list
+    rather than being closed, and the next context (on any thread) takes the
+    most recently used one, whose page cache is still warm. The PRAGMA
+    profile is applied once, when a connection is opened.
+    """
+
+    def __init__(self, database, pragmas, max_idle=4):
+        self.database = database
+        self.pragmas = dict(pragmas)
+        self.max_idle = max_idle
+
+        self._idle = []
+        self._lock = threading.Lock()
+        self._in_use = {}       # Thread name -> connections it holds
+
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+        # Never writes, so its data_version moves whenever anyone else commits
+        self._watcher = None
+
+    def _connect(self):
+        db = sqlite3.connect(
+            self.database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False     # Only ever used by one thread at a time
+        )
+        db.row_factory = sqlite3.Row
+        apply_pragmas(db, self.pragmas)
+        return db
+
+    def acquire(self):
+        thread = threading.current_thread().name
+        with self._lock:
+            self._in_use[thread] = self._in_use.get(thread, 0) + 1
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.opened += 1
+
+        try:
+            return self._connect()
+        except sqlite3.Error:
+            self._checked_in(thread)
+            raise
+
+    def release(self, db):
+        self._checked_in(threading.current_thread().name)
+
+        if db.in_transaction:
+            # Don't hand someone else a half-finished transaction
+            db.rollback()
+
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(db)
+                return
+            self.closed += 1
+        db.close()
+
+    def _checked_in(self, thread):
+        with self._lock:
+            self._in_use[thread] -= 1
+            if not self._in_use[thread]:
+                del self._in_use[thread]
+
+    def data_version(self):
+        """
+        A number that changes whenever any connection, in this process or
+        another (esp32.py, say), commits to the database. Only comparable
+        with other values from this pool.
+        """
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = sqlite3.connect(self.database, check_same_thread=False)
+            return self._watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.closed += len(idle)
+            watcher, self._watcher = self._watcher, None
+        for db in idle:
+            db.close()
+        if watcher is not None:
+            watcher.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'database': self.database,
+                'pragmas': dict(self.pragmas),
+                'opened': self.opened,
+                'reused': self.reused,
+                'closed': self.closed,
+                'idle': len(self._idle),
+                'in_use': sum(self._in_use.values()),
+                'threads': dict(self._in_use),
+            }
+
+
+def get_pool(app=None):
+    app = app or current_app
+    pool = app.extensions.get('sqlite_pool')
+    if pool is None or pool.database != app.config['DATABASE']:
+        # First use, or DATABASE was changed after create_app
+        if pool is not None:
+            pool.close()
+        pool = app.extensions['sqlite_pool'] = ConnectionPool(
+            app.config['DATABASE'],
+            app.config.get('SQLITE_PRAGMAS', {}),
+            app.config.get('SQLITE_POOL_SIZE', 4)
+        )
+    return pool
+
+
+def data_version(app=None):
+    """ Cache key for anything computed from the database; see ConnectionPool.data_version """
+    return get_pool(app).data_version()
+
+
+def pool_stats(app=None):
+    """ Connection pool counters, for the GUI or a debugging shell """
+    return get_pool(app).stats()
+
+
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
 
     return g.db
 
 
 def close_db(e=None):
     db = g.pop('db', None)
+    pool = g.pop('db_pool', None)
 
     if db is not None:
-        db.close()
+        pool.release(db)
+
+
+# Schema changes live in migrations/NNNN_name.sql and are applied in order.
+# PRAGMA user_version records the last one applied.
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+
+
+def list_migrations():
+    """ (version, path) of every migration script, oldest first """
+    migrations = []
+    for name in sorted(os.listdir(MIGRATIONS_DIR)):
+        if name.endswith('.sql'):
+            migrations.append((int(name.split('_', 1)[0]), os.path.join(MIGRATIONS_DIR, name)))
+    return migrations
+
+
+def migrate(db):
+    """
+    Apply every migration newer than the database's user_version.
+    Each one runs in its own transaction together with the user_version bump,
+    so a failed migration leaves the database at the previous version.
+    Works on any sqlite3 connection, with or without an app context.
+    Returns the versions applied.
+    """
+    current = db.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
 
+    for version, path in list_migrations():
+        if version <= current:
+            continue
 
-def init_db():
+        with open(path, encoding='utf8') as f:
+            script = f.read()
+        try:
+            db.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;")
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.rollback()
+            raise sqlite3.OperationalError(f"{os.path.basename(path)}: {e}") from e
+        applied.append(version)
+
+    return applied
+
+
+def reset_db(db):
+    """ Drop every table and view, leaving an empty database at version 0 """
+    objects = db.execute(
+        "SELECT type, name FROM sqlite_master "
+        "WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' "
+        "ORDER BY type = 'table'"       # Views first
+    ).fetchall()
+
+    previous = db.execute("PRAGMA foreign_keys").fetchone()[0]
+    db.execute("PRAGMA foreign_keys = OFF")
+    for kind, name in objects:
+        db.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+    db.execute("PRAGMA user_version = 0")
+    db.commit()
+    db.execute(f"PRAGMA foreign_keys = {previous}")
+
+
+def init_db(reset=False):
     db = get_db()
 
-    with current_app.open_resource('schema.sql') as f:
-        db.executescript(f.read().decode('utf8'))
+    if reset:
+        reset_db(db)
+
+        # Monthly partitions (see partitions.py) are accessLog rows too
+        directory = current_app.config.get('PARTITION_DIR')
+        if directory and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.startswith('accessLog_') and name.endswith('.sqlite'):
+                    os.remove(os.path.join(directory, name))
+    return migrate(db)
 
 
 @click.command('init-db')
-def init_db_command():
-    """ Clear existing data and create new tables """
-    init_db()
-    click.echo('Tables defined in schema.sql created successfully')
+@click.option('--reset', is_flag=True, help='Drop all existing tables and data first')
+def init_db_command(reset):
+    """ Create new tables, or bring an existing database's up to date """
+    applied = init_db(reset)
+    version = get_db().execute("PRAGMA user_version").fetchone()[0]
+    if applied:
+        click.echo(f'Applied migrations {", ".join(map(str, applied))}; schema is at version {version}')
+    else:
+        click.echo(f'Schema already up to date (version {version})')
+
+
+def check_query_plans(queries, tables=('accessLog', 'accessHourly', 'accessDaily')):
+    """
+    EXPLAIN QUERY PLAN each of {name: sql or (sql, params)} and find any full scans of tables.
+    Returns {name: (plan details, [scans])}.
+    """
+    db = get_db()
+    plans = {}
+
+    for name, sql in queries.items():
+        # Queries with placeholders come as (sql, example params)
+        sql, params = sql if isinstance(sql, tuple) else (sql, ())
+        details = [row['detail'] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        scans = [
+            detail for detail in details
+            if any(detail == f'SCAN {table}' or detail.startswith(f'SCAN {table} ') for table in tables)
+        ]
+        plans[name] = (details, scans)
+
+    return plans
+
+
+@click.command('check-plans')
+def check_plans_command():
+    """ Check the dashboard queries are answered from an index, not a full scan """
+    from flaskr.plotting import DASHBOARD_QUERIES
+
+    try:
+        plans = check_query_plans(DASHBOARD_QUERIES)
+    except sqlite3.Error as e:
+        raise click.ClickException(f'{e} (has init-db been run?)')
+
+    failed = False
+    for name, (details, scans) in plans.items():
+        click.echo(f'{name}: {"FULL SCAN" if scans else "ok"}')
+        for detail in details:
+            click.echo(f'    {detail}')
+        failed = failed or bool(scans)
+
+    if failed:
+        raise click.ClickException('Some dashboard queries scan a whole table; run init-db to migrate')
+
+
+# Rollup tables from migrations/0003_access_rollups.sql: table -> (period column, period of a.accessed)
+ROLLUPS = {
+    'accessHourly': ('hour', "strftime('%Y-%m-%d %H:00:00', a.accessed)"),
+    'accessDaily': ('day', "date(a.accessed)"),
+}
+
+
+def has_rollups(db):
+    return db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'accessDaily'"
+    ).fetchone() is not None
+
+
+def add_to_rollups(db, source):
+    """
+    Count the rows of source (anything with RFID_key, accessed and
+    is_authorised columns) into the rollups, in one grouped pass rather than
+    a trigger firing per row. Doesn't commit.
+    """
+    for table, (column, period) in ROLLUPS.items():
+        db.execute(
+            f"INSERT INTO {table} ({column}, department_id, is_authorised, accesses) "
+            f"SELECT {period}, COALESCE(u.department_id, 0), COALESCE(a.is_authorised, 0), COUNT(*) "
+            f"FROM {source} a LEFT JOIN users u ON u.RFID_key = a.RFID_key "
+            "GROUP BY 1, 2, 3 "
+            "ON CONFLICT DO UPDATE SET accesses = accesses + excluded.accesses"
+        )
+
+
+def rebuild_rollups():
+    db = get_db()
+    for table in ROLLUPS:
+        db.execute(f"DELETE FROM {table}")
+    add_to_rollups(db, 'accessLog')
+    db.commit()
+
+
+@click.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """ Recount accessHourly and accessDaily from accessLog """
+    rebuild_rollups()
+    days = get_db().execute("SELECT COUNT(DISTINCT day) FROM accessDaily").fetchone()[0]
+    click.echo(f'Rollups rebuilt ({days} days of scans)')
+
+
+# Importing esp32.py's CSV log (timestamp_utc, uid, granted, device_millis, client_ip)
+IMPORT_CHUNK_ROWS = 100_000
+IMPORT_ACTION_TYPE = 'scan'     # Same as esp32.ACTION_TYPE
+
+IMPORT_SETUP = """
+    CREATE TABLE IF NOT EXISTS importProgress (
+        path TEXT PRIMARY KEY,
+        offset INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS importDeferred (
+        name TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        sql TEXT NOT NULL
+    );
+    CREATE TEMP TABLE IF NOT EXISTS importStaging (
+        RFID_key TEXT NOT NULL,
+        accessed TIMESTAMP NOT NULL,
+        is_authorised INTEGER,
+        PRIMARY KEY (RFID_key, accessed)
+    ) WITHOUT ROWID;
+    CREATE TEMP TABLE IF NOT EXISTS importSeen (
+        RFID_key TEXT NOT NULL,
+        accessed TIMESTAMP NOT NULL,
+        PRIMARY KEY (RFID_key, accessed)
+    ) WITHOUT ROWID;
+"""
+
+
+def _defer_access_indexes(db):
+    """
+    Drop accessLog's indexes until the import is done. Its triggers stay:
+    esp32.py may be logging scans meanwhile, and they have to be counted.
+    """
+    # Remember the definitions first, so an interrupted import can still put them back
+    db.execute(
+        "INSERT OR IGNORE INTO importDeferred (name, type, sql) "
+        "SELECT name, type, sql FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = 'accessLog' AND sql IS NOT NULL"
+    )
+    for (name,) in db.execute("SELECT name FROM importDeferred WHERE type = 'index'").fetchall():
+        db.execute(f'DROP INDEX IF EXISTS "{name}"')
+    db.commit()
+
+
+def _rebuild_access_indexes(db):
+    for name, sql in db.execute("SELECT name, sql FROM importDeferred").fetchall():
+        exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+        if exists is None:
+            db.execute(sql)
+        db.execute("DELETE FROM importDeferred WHERE name = ?", (name,))
+    db.commit()
+
+
+def _read_log_chunk(f, chunk_rows):
+    """
+    Read up to chunk_rows complete lines, returning them as accessLog rows,
+    plus their size in bytes and how many lines couldn't be parsed (which
+    are skipped)
+    """
+    rows = []
+    size = malformed = 0
+    for line in f:
+        if not line.endswith(b'\n'):
+            # esp32.py is still writing this one
+            break
+        size += len(line)
+
+        try:
+            timestamp, uid, granted = line.decode('utf-8').split(',', 3)[:3]
+            accessed = datetime.fromisoformat(timestamp).astimezone(timezone.utc).replace(tzinfo=None)
+            rows.append((uid, accessed.isoformat(sep=' ', timespec='microseconds'), int(granted)))
+        except ValueError:
+            malformed += 1
+
+        if len(rows) + malformed >= chunk_rows:
+            break
+    return rows, size, malformed
+
+
+def import_log(path, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Stream an esp32.py CSV log into accessLog.
+
+    The file is read chunk_rows lines at a time, each chunk going in as one
+    transaction together with the byte offset reached, so an interrupted
+    import resumes where it stopped. Rows already in accessLog with the same
+    (RFID_key, accessed) are skipped, as are lines that can't be parsed.
+    accessLog's indexes are dropped for the duration and rebuilt once at the
+    end (or when the import fails). Each chunk is counted into the rollups
+    in one grouped update, the per-row insert trigger being suspended inside
+    that chunk's transaction only, so scans logged alongside the import are
+    still counted by it. Scans already moved to a partition are skipped too.
+    Returns (rows imported, duplicates skipped, malformed lines skipped).
+    """
+    db = get_db()
+    path = os.path.abspath(path)
+
+    # The connection goes back to the pool afterwards, so put these back when done
+    previous = {name: db.execute(f"PRAGMA {name}").fetchone()[0] for name in ('temp_store', 'foreign_keys')}
+    db.execute("PRAGMA temp_store = FILE")      # Keep the dedupe table out of RAM
+    db.execute("PRAGMA foreign_keys = OFF")     # Unknown cards are logged, as esp32.py's sqlite sink does
+    db.executescript(IMPORT_SETUP)
+    _defer_access_indexes(db)
+    try:
+        return _import_chunks(db, path, chunk_rows)
+    finally:
+        # Whatever happened, leave accessLog with its indexes
+        if db.in_transaction:
+            db.rollback()
+        _rebuild_access_indexes(db)
+        db.execute("DROP TABLE IF EXISTS temp.importSeen")
+        db.execute("DROP TABLE IF EXISTS temp.importStaging")
+        apply_pragmas(db, previous)
+
+
+def _seed_import_seen(db):
+    """ Fill importSeen with every scan already logged, archived months included """
+    from flaskr import partitions     # Which imports this module
+
+    db.execute("INSERT OR IGNORE INTO importSeen SELECT RFID_key, accessed FROM main.accessLog")
+    db.commit()
+
+    for partition in partitions.archived_partitions():
+        partitions.attach_partition(db, partition['month'])
+        try:
+            db.execute("INSERT OR IGNORE INTO importSeen SELECT RFID_key, accessed FROM part.accessLog")
+            db.commit()
+        finally:
+            if db.in_transaction:
+                db.rollback()
+            partitions.detach_partition(db)
+
+
+def _import_chunks(db, path, chunk_rows):
+    rollups = has_rollups(db)
+    trigger = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'accesslog_rollup_insert'"
+    ).fetchone()
+
+    _seed_import_seen(db)
+
+    row = db.execute("SELECT offset FROM importProgress WHERE path = ?", (path,)).fetchone()
+    offset = row['offset'] if row is not None else 0
+    if offset > os.path.getsize(path):
+        # The log has been replaced since we last saw it
+        offset = 0
+
+    imported = skipped = malformed = 0
+    with open(path, 'rb') as f:
+        if offset:
+            f.seek(offset)
+        else:
+            offset = len(f.readline())      # Header
+
+        while True:
+            rows, size, bad = _read_log_chunk(f, chunk_rows)
+            if not size:
+                break
+            malformed += bad
+
+            db.execute("BEGIN")
+            db.executemany("INSERT OR IGNORE INTO importStaging VALUES (?, ?, ?)", rows)
+            db.execute(
+                "DELETE FROM importStaging WHERE EXISTS ("
+                "SELECT 1 FROM importSeen s "
+                "WHERE s.RFID_key = importStaging.RFID_key AND s.accessed = importStaging.accessed)"
+            )
+            # Counted in one grouped pass below instead of by the trigger row by
+            # row. Dropped in this transaction only, so no other writer ever
+            # finds it missing
+            if trigger is not None:
+                db.execute("DROP TRIGGER accesslog_rollup_insert")
+            cursor = db.execute(
+                "INSERT INTO accessLog (RFID_key, accessed, received, actiontype, is_authorised) "
+                "SELECT RFID_key, accessed, accessed, ?, is_authorised FROM importStaging ORDER BY accessed",
+                (IMPORT_ACTION_TYPE,)
+            )
+            if trigger is not None:
+                db.execute(trigger['sql'])
+            imported += cursor.rowcount
+            skipped += len(rows) - cursor.rowcount
+            if rollups:
+                add_to_rollups(db, 'temp.importStaging')
+
+            db.execute("INSERT INTO importSeen SELECT RFID_key, accessed FROM importStaging")
+            db.execute("DELETE FROM importStaging")
+
+            offset += size
+            db.execute(
+                "INSERT OR REPLACE INTO importProgress (path, offset) VALUES (?, ?)",
+                (path, offset)
+            )
+            db.commit()
+
+    return imported, skipped, malformed
+
+
+@click.command('import-log')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-rows', default=IMPORT_CHUNK_ROWS, show_default=True,
+              help='Rows read and committed per transaction')
+def import_log_command(csv_path, chunk_rows):
+    """ Import (or carry on importing) esp32.py's CSV access log into accessLog """
+    imported, skipped, malformed = import_log(csv_path, chunk_rows)
+    click.echo(f'Imported {imported} rows from {csv_path} ({skipped} duplicates skipped'
+               + (f', {malformed} malformed lines skipped)' if malformed else ')'))
 
 
 sqlite3.register_converter(
@@ -44,3 +549,6 @@ sqlite3.register_converter(
 def init_app(app):
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(check_plans_command)
+    app.cli.add_command(import_log_command)
+    app.cli.add_command(rebuild_rollups_command)
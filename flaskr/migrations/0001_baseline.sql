@@ -1,15 +1,11 @@
-PRAGMA foreign_keys = ON;
-
-DROP TABLE IF EXISTS accessLog;
-DROP TABLE IF EXISTS users;
-DROP TABLE IF EXISTS departments;
-
-CREATE TABLE departments (
+-- The tables init-db used to DROP and recreate, made safe to run against
+-- a database that already has them
+CREATE TABLE IF NOT EXISTS departments (
     department_id INTEGER PRIMARY KEY,
     department_name TEXT NOT NULL
 );
 
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     fname TEXT NOT NULL,
     lname TEXT NOT NULL,
@@ -20,7 +16,7 @@ CREATE TABLE users (
     FOREIGN KEY (department_id) REFERENCES departments(department_id)
 );
 
-CREATE TABLE accessLog (
+CREATE TABLE IF NOT EXISTS accessLog (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     RFID_key TEXT NOT NULL,
     accessed TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
@@ -30,10 +26,10 @@ CREATE TABLE accessLog (
     FOREIGN KEY (RFID_key) REFERENCES users(RFID_key)
 );
 
-CREATE INDEX idx_accesslog_rfid ON accessLog(RFID_key);
+CREATE INDEX IF NOT EXISTS idx_accesslog_rfid ON accessLog(RFID_key);
 
 
-INSERT INTO departments(department_id, department_name) VALUES
+INSERT OR IGNORE INTO departments(department_id, department_name) VALUES
 (1, 'Administration'),
 (2, 'Marketing'),
 (3, 'Purchasing'),
@@ -53,4 +49,3 @@ INSERT INTO departments(department_id, department_name) VALUES
 (17, 'NOC'),
 (18, 'Helpdesk'),
 (19, 'Recruiting');
-
@@ -0,0 +1,7 @@
+-- Every dashboard query filters accessLog on a range of accessed
+CREATE INDEX IF NOT EXISTS idx_accesslog_accessed ON accessLog(accessed);
+CREATE INDEX IF NOT EXISTS idx_accesslog_rfid_accessed ON accessLog(RFID_key, accessed);
+CREATE INDEX IF NOT EXISTS idx_accesslog_authorised_accessed ON accessLog(is_authorised, accessed);
+
+-- (RFID_key, accessed) answers everything this one did
+DROP INDEX IF EXISTS idx_accesslog_rfid;
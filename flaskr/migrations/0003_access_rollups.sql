@@ -0,0 +1,101 @@
+-- Scan counts per hour and per day, per department and authorised/denied,
+-- so the dashboards read a few hundred rows instead of all of accessLog.
+-- Cards with no user are counted under department 0.
+-- Departments are looked up when the scan is logged; after moving people
+-- between departments, `flask rebuild-rollups` recounts history.
+CREATE TABLE IF NOT EXISTS accessHourly (
+    hour TEXT NOT NULL,             -- 'YYYY-MM-DD HH:00:00', UTC like accessed
+    department_id INTEGER NOT NULL,
+    is_authorised INTEGER NOT NULL,
+    accesses INTEGER NOT NULL,
+    PRIMARY KEY (hour, department_id, is_authorised)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS accessDaily (
+    day TEXT NOT NULL,              -- 'YYYY-MM-DD'
+    department_id INTEGER NOT NULL,
+    is_authorised INTEGER NOT NULL,
+    accesses INTEGER NOT NULL,
+    PRIMARY KEY (day, department_id, is_authorised)
+) WITHOUT ROWID;
+
+
+CREATE TRIGGER IF NOT EXISTS accesslog_rollup_insert AFTER INSERT ON accessLog
+BEGIN
+    INSERT INTO accessHourly (hour, department_id, is_authorised, accesses)
+    VALUES (
+        strftime('%Y-%m-%d %H:00:00', NEW.accessed),
+        COALESCE((SELECT department_id FROM users WHERE RFID_key = NEW.RFID_key), 0),
+        COALESCE(NEW.is_authorised, 0),
+        1
+    )
+    ON CONFLICT DO UPDATE SET accesses = accesses + 1;
+
+    INSERT INTO accessDaily (day, department_id, is_authorised, accesses)
+    VALUES (
+        date(NEW.accessed),
+        COALESCE((SELECT department_id FROM users WHERE RFID_key = NEW.RFID_key), 0),
+        COALESCE(NEW.is_authorised, 0),
+        1
+    )
+    ON CONFLICT DO UPDATE SET accesses = accesses + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS accesslog_rollup_delete AFTER DELETE ON accessLog
+BEGIN
+    UPDATE accessHourly SET accesses = accesses - 1
+    WHERE hour = strftime('%Y-%m-%d %H:00:00', OLD.accessed)
+    AND department_id = COALESCE((SELECT department_id FROM users WHERE RFID_key = OLD.RFID_key), 0)
+    AND is_authorised = COALESCE(OLD.is_authorised, 0);
+
+    UPDATE accessDaily SET accesses = accesses - 1
+    WHERE day = date(OLD.accessed)
+    AND department_id = COALESCE((SELECT department_id FROM users WHERE RFID_key = OLD.RFID_key), 0)
+    AND is_authorised = COALESCE(OLD.is_authorised, 0);
+END;
+
+CREATE TRIGGER IF NOT EXISTS accesslog_rollup_update AFTER UPDATE OF RFID_key, accessed, is_authorised ON accessLog
+BEGIN
+    UPDATE accessHourly SET accesses = accesses - 1
+    WHERE hour = strftime('%Y-%m-%d %H:00:00', OLD.accessed)
+    AND department_id = COALESCE((SELECT department_id FROM users WHERE RFID_key = OLD.RFID_key), 0)
+    AND is_authorised = COALESCE(OLD.is_authorised, 0);
+
+    UPDATE accessDaily SET accesses = accesses - 1
+    WHERE day = date(OLD.accessed)
+    AND department_id = COALESCE((SELECT department_id FROM users WHERE RFID_key = OLD.RFID_key), 0)
+    AND is_authorised = COALESCE(OLD.is_authorised, 0);
+
+    INSERT INTO accessHourly (hour, department_id, is_authorised, accesses)
+    VALUES (
+        strftime('%Y-%m-%d %H:00:00', NEW.accessed),
+        COALESCE((SELECT department_id FROM users WHERE RFID_key = NEW.RFID_key), 0),
+        COALESCE(NEW.is_authorised, 0),
+        1
+    )
+    ON CONFLICT DO UPDATE SET accesses = accesses + 1;
+
+    INSERT INTO accessDaily (day, department_id, is_authorised, accesses)
+    VALUES (
+        date(NEW.accessed),
+        COALESCE((SELECT department_id FROM users WHERE RFID_key = NEW.RFID_key), 0),
+        COALESCE(NEW.is_authorised, 0),
+        1
+    )
+    ON CONFLICT DO UPDATE SET accesses = accesses + 1;
+END;
+
+
+-- Count what is already there
+DELETE FROM accessHourly;
+DELETE FROM accessDaily;
+
+INSERT INTO accessHourly (hour, department_id, is_authorised, accesses)
+SELECT strftime('%Y-%m-%d %H:00:00', a.accessed), COALESCE(u.department_id, 0), COALESCE(a.is_authorised, 0), COUNT(*)
+FROM accessLog a LEFT JOIN users u ON u.RFID_key = a.RFID_key
+GROUP BY 1, 2, 3;
+
+INSERT INTO accessDaily (day, department_id, is_authorised, accesses)
+SELECT date(a.accessed), COALESCE(u.department_id, 0), COALESCE(a.is_authorised, 0), COUNT(*)
+FROM accessLog a LEFT JOIN users u ON u.RFID_key = a.RFID_key
+GROUP BY 1, 2, 3;
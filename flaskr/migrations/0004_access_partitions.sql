@@ -0,0 +1,8 @@
+-- Closed months of accessLog that `flask partition-log` has moved out into
+-- their own files (see partitions.py). The rollups keep counting them.
+CREATE TABLE IF NOT EXISTS accessPartitions (
+    month TEXT PRIMARY KEY,         -- 'YYYYMM'
+    filename TEXT NOT NULL,         -- In the PARTITION_DIR directory
+    rows INTEGER NOT NULL,
+    archived TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
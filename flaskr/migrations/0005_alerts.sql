@@ -0,0 +1,17 @@
+-- Unusual activity flagged by anomaly.py, newest looked at first
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    raised TIMESTAMP NOT NULL,      -- When the scan that triggered it was received (UTC)
+    kind TEXT NOT NULL,             -- denied_burst, off_hours, rate_spike or unknown_uid
+    RFID_key TEXT,
+    door TEXT,                      -- Reader's address, when known
+    detail TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_alerts_raised ON alerts(raised);
+
+-- How far `python anomaly.py` has read through accessLog
+CREATE TABLE IF NOT EXISTS alertCheckpoint (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_id INTEGER NOT NULL
+);
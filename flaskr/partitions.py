@@ -0,0 +1,254 @@
+"""
+Monthly partitions of accessLog.
+
+Closed months are moved out of flaskr.sqlite into their own files,
+PARTITION_DIR/accessLog_YYYYMM.sqlite, so the hot database only holds the
+current month and stays small enough to live in the page cache. The moved
+months are listed in accessPartitions. querying.fetch_access_log() reads
+across them one at a time, access_log_view() shows the SQL console the
+most recent ones as the TEMP view accessLogAll, and retention is just
+deleting old files.
+"""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+import click
+from flask import current_app
+
+from flaskr.db import get_db
+
+PARTITION_TABLE = """
+    CREATE TABLE IF NOT EXISTS {schema}.accessLog (
+        id INTEGER PRIMARY KEY,
+        RFID_key TEXT NOT NULL,
+        accessed TIMESTAMP NOT NULL,
+        received TIMESTAMP NOT NULL,
+        actiontype TEXT NOT NULL,
+        is_authorised INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS {schema}.idx_accesslog_accessed ON accessLog(accessed);
+    CREATE INDEX IF NOT EXISTS {schema}.idx_accesslog_rfid_accessed ON accessLog(RFID_key, accessed);
+"""
+
+# accessLog and the newest partitions, while access_log_view() holds them attached
+ACCESS_LOG_VIEW = 'accessLogAll'
+
+
+def month_bounds(month):
+    """ 'YYYYMM' -> ('YYYY-MM-01', first day of the next month) """
+    year, number = int(month[:4]), int(month[4:])
+    start = date(year, number, 1)
+    end = date(year + number // 12, number % 12 + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+
+def months_between(start, end):
+    """ Every 'YYYYMM' touched by the range start <= accessed < end (ISO strings) """
+    year, number = int(start[:4]), int(start[5:7])
+    months = []
+    while date(year, number, 1).isoformat() < end:
+        months.append(f'{year:04d}{number:02d}')
+        year, number = year + number // 12, number % 12 + 1
+    return months
+
+
+def partition_path(filename, app=None):
+    app = app or current_app
+    return os.path.join(app.config['PARTITION_DIR'], filename)
+
+
+def attach_partition(db, month, schema='part'):
+    """ Attach a month's partition file as schema (creating it if needed) """
+    db.commit()     # Can't ATTACH inside a transaction
+    os.makedirs(current_app.config['PARTITION_DIR'], exist_ok=True)
+    db.execute("ATTACH DATABASE ? AS " + schema, (partition_path(f'accessLog_{month}.sqlite'),))
+    db.executescript(PARTITION_TABLE.format(schema=schema))
+
+
+def detach_partition(db, schema='part'):
+    db.execute("DETACH DATABASE " + schema)
+
+
+@contextmanager
+def access_log_view(db, months=None):
+    """
+    Attach the newest months partitions (ACCESS_LOG_VIEW_MONTHS by default)
+    and create the TEMP view accessLogAll, a UNION ALL of them and
+    main.accessLog, for the length of the block. A WHERE on accessed is
+    pushed down into every branch, so each is still read through its index.
+
+    SQLite attaches at most 10 databases at once (SQLITE_LIMIT_ATTACHED), so
+    the view never covers more than that; fetch_access_log() reaches any
+    range. Statements reading the view must be finished or closed before
+    the block ends: SQLite won't DETACH a database a statement is still
+    reading ("database is locked").
+    """
+    months = months or current_app.config['ACCESS_LOG_VIEW_MONTHS']
+    attached = sum(1 for row in db.execute("PRAGMA database_list") if row[1] not in ('main', 'temp'))
+    months = min(months, db.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - attached)
+
+    schemas = []
+    try:
+        for partition in archived_partitions()[-months:] if months > 0 else []:
+            schema = f'part{len(schemas)}'
+            attach_partition(db, partition['month'], schema)
+            schemas.append(schema)
+
+        branches = [
+            f"SELECT id, RFID_key, accessed, received, actiontype, is_authorised FROM {schema}.accessLog"
+            for schema in schemas + ['main']
+        ]
+        db.execute(f"CREATE TEMP VIEW {ACCESS_LOG_VIEW} AS " + " UNION ALL ".join(branches))
+        yield ACCESS_LOG_VIEW
+    finally:
+        db.execute(f"DROP VIEW IF EXISTS temp.{ACCESS_LOG_VIEW}")
+        if db.in_transaction:
+            db.commit()     # Can't DETACH inside one either
+        for schema in schemas:
+            detach_partition(db, schema)
+
+
+def archive_month(db, month):
+    """
+    Move one month of accessLog into its partition file. Returns rows moved.
+
+    The copy is committed in the partition before the rows are deleted here,
+    so a crash in between leaves them in both places rather than neither.
+    Running it again finishes the job (ids already copied are skipped).
+    """
+    start, end = month_bounds(month)
+
+    attach_partition(db, month)
+    try:
+        db.execute(
+            "INSERT OR IGNORE INTO part.accessLog "
+            "SELECT id, RFID_key, accessed, received, actiontype, is_authorised FROM main.accessLog "
+            "WHERE accessed >= ? AND accessed < ?",
+            (start, end)
+        )
+        db.commit()
+        total = db.execute("SELECT COUNT(*) FROM part.accessLog").fetchone()[0]
+    finally:
+        detach_partition(db)
+
+    # The rollups should keep counting archived scans, so the delete trigger is
+    # suspended (in this transaction only) while the month is removed
+    db.execute("BEGIN")
+    trigger = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'accesslog_rollup_delete'"
+    ).fetchone()
+    if trigger is not None:
+        db.execute("DROP TRIGGER accesslog_rollup_delete")
+    moved = db.execute(
+        "DELETE FROM accessLog WHERE accessed >= ? AND accessed < ?", (start, end)
+    ).rowcount
+    if trigger is not None:
+        db.execute(trigger['sql'])
+
+    db.execute(
+        "INSERT OR REPLACE INTO accessPartitions (month, filename, rows) VALUES (?, ?, ?)",
+        (month, f'accessLog_{month}.sqlite', total)
+    )
+    db.commit()
+    return moved
+
+
+def archive_closed_months(keep_months=1):
+    """
+    Archive every month of accessLog older than the last keep_months
+    (1 keeps just the current month). Returns {month: rows moved}.
+    """
+    db = get_db()
+
+    today = datetime.now(timezone.utc).date()     # accessed is UTC
+    months_back = today.year * 12 + today.month - keep_months
+    cutoff = date(months_back // 12, months_back % 12 + 1, 1).isoformat()
+
+    moved = {}
+    while True:
+        # Oldest first, straight off idx_accesslog_accessed
+        oldest = db.execute(
+            "SELECT strftime('%Y%m', MIN(accessed)) FROM accessLog WHERE accessed < ?", (cutoff,)
+        ).fetchone()[0]
+        if oldest is None:
+            break
+        moved[oldest] = archive_month(db, oldest)
+
+    return moved
+
+
+def list_partitions(start=None, end=None):
+    """ accessPartitions rows, oldest first, optionally only those touching [start, end) """
+    db = get_db()
+    rows = db.execute("SELECT month, filename, rows FROM accessPartitions ORDER BY month").fetchall()
+    if start is None:
+        return rows
+
+    wanted = set(months_between(start, end))
+    return [row for row in rows if row['month'] in wanted]
+
+
+def archived_partitions(start=None, end=None):
+    """ list_partitions(), leaving out any whose file has gone """
+    return [row for row in list_partitions(start, end) if os.path.exists(partition_path(row['filename']))]
+
+
+def prune_partitions(retention_months):
+    """ Forget and delete partitions older than retention_months. Returns the months removed """
+    db = get_db()
+
+    today = datetime.now(timezone.utc).date()     # accessed is UTC
+    months_back = today.year * 12 + today.month - 1 - retention_months
+    oldest_kept = f'{months_back // 12:04d}{months_back % 12 + 1:02d}'
+
+    removed = []
+    for row in db.execute(
+        "SELECT month, filename FROM accessPartitions WHERE month < ? ORDER BY month", (oldest_kept,)
+    ).fetchall():
+        db.execute("DELETE FROM accessPartitions WHERE month = ?", (row['month'],))
+        db.commit()
+
+        path = partition_path(row['filename'])
+        if os.path.exists(path):
+            os.remove(path)
+        removed.append(row['month'])
+
+    return removed
+
+
+@click.command('partition-log')
+@click.option('--keep-months', default=1, show_default=True,
+              help='Recent months to leave in the main database (1: just this one)')
+@click.option('--vacuum', is_flag=True, help='VACUUM the main database afterwards to give the space back')
+def partition_log_command(keep_months, vacuum):
+    """ Move closed months of accessLog into their own partition files """
+    moved = archive_closed_months(keep_months)
+    for month, rows in moved.items():
+        click.echo(f'{month}: moved {rows} rows to accessLog_{month}.sqlite')
+    if not moved:
+        click.echo('No closed months to archive')
+
+    if vacuum:
+        get_db().execute("VACUUM")
+
+
+@click.command('prune-partitions')
+@click.option('--retention-months', type=int, default=None,
+              help='Months of partitions to keep (default: the ACCESS_LOG_RETENTION_MONTHS setting)')
+def prune_partitions_command(retention_months):
+    """ Delete partition files past the retention period """
+    if retention_months is None:
+        retention_months = current_app.config['ACCESS_LOG_RETENTION_MONTHS']
+    if retention_months is None:
+        raise click.ClickException('No retention period set (ACCESS_LOG_RETENTION_MONTHS or --retention-months)')
+
+    removed = prune_partitions(retention_months)
+    click.echo(f'Removed {len(removed)} partitions' + (f' ({", ".join(removed)})' if removed else ''))
+
+
+def init_app(app):
+    app.cli.add_command(partition_log_command)
+    app.cli.add_command(prune_partitions_command)
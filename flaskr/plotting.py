@@ -3,81 +3,52 @@ This code contains functions regarding the plotting of graphs, barcharts, piecha
 Based on data contained within the database
 """
 import datetime
+import hashlib
+import io
+import os
+import threading
+
+import numpy as np
 from matplotlib.figure import Figure
-import flaskr.querying as querying
+import flaskr.aggregation as aggregation
+from flaskr.cache import LRUCache
+from flaskr.db import data_version, get_db
 
 
-# Separate const because it's too long
-# Generated with the help of ChatGPT because God only knows how this works
-QUARTER_QUERY = """
-    SELECT COUNT(*) 
-    FROM accessLog
-    WHERE strftime('%Y', accessed) = strftime('%Y', 'now')
-    AND ((CAST(strftime('%m', accessed) AS INTEGER) - 1)/3 + 1) = ((CAST(strftime('%m', 'now') AS INTEGER) - 1)/3 + 1)
-"""
+# What the dashboard runs, for `flask check-plans`. The counts come from
+# accessDaily's primary key range, never a scan of accessLog.
+DASHBOARD_QUERIES = {
+    'departments': aggregation.DEPARTMENTS_QUERY,
+    'daily_counts': (aggregation.DAILY_COUNTS_QUERY, {'start': '2000-01-01', 'end': '2000-04-01'}),
+}
 
-def get_days_in_quarter():
-    # Get the start and end of the quarter
-    now = datetime.datetime.now()
-    current_month = now.month
-    start_month = (current_month - 1) // 3 * 3 + 1  # First month of the current quarter
-    start_date = datetime.datetime(now.year, start_month, 1)
-    if current_month % 3 == 0:
-        end_date = datetime.datetime(now.year, current_month, 31)
-    else:
-        end_month = start_month + 2  # Last month of the current quarter
-        end_date = datetime.datetime(now.year, end_month + 1, 1) - datetime.timedelta(days=1)
-
-    # Calculate the number of days in the current quarter
-    delta = end_date - start_date
-    return delta.days + 1  # Include end date
-
-def BarchartPlot(app):
-    # Test data to plot
-    # TODO: Fix the way this is layed out to show accesses per department
-    #       And make it look better
-    x = [
-        'Administration',
-        'Marketing',
-        'Purchasing',
-        'Human Resources',
-        'Shipping',
-        'IT',
-        'Public Relations',
-        'Sales',
-        'Executive',
-        'Finance',
-        'Accounting',
-        'Treasury',
-        'Shareholder Services',
-        'Manufacturing',
-        'Contracting',
-        'Operational Security',
-        'NOC',
-        'Helpdesk',
-        'Recruiting'
-    ]
-    
-    # Get access counts
-    with app.app_context():
-        y1_result = querying.execute_sql_query("SELECT COUNT(*) FROM accessLog WHERE accessed >= DATE('now') AND accessed < DATE('now', '+1 day')", -1)
-        y2_result = querying.execute_sql_query("SELECT COUNT(*) FROM accessLog WHERE accessed >= date('now', 'weekday 0', '-6 day') AND accessed < date('now', 'weekday 0', '+1 day')", -1)
-        y3_result = querying.execute_sql_query(QUARTER_QUERY, -1)
-    
-    # Extracting values from query results
-    y1 = [r[0] for r in y1_result]  # Number of accesses today
-    y2 = [r[0] for r in y2_result]  # Number of accesses this week
-    y3 = [r[0] for r in y3_result]  # Total number of accesses this quarter
+def DepartmentBarchart(names, values, title, ylabel='Authorised Accesses'):
+    # One chart of a value per department, for the charts blueprint
+    fig = Figure(figsize=(10, 5), dpi=100)
+
+    chart = fig.add_subplot(1, 1, 1)
+    chart.bar(names, values, color='blue')
+    chart.set_title(title)
+    chart.set_xlabel('Departments')
+    chart.set_ylabel(ylabel)
+    chart.tick_params(axis='x', labelrotation=90)
+
+    fig.tight_layout(pad=3)
+    return fig
 
-    # Calculate average accesses per day for this quarter (y4)
-    total_accesses = y3[0] if y3 else 0  # Total accesses from the query result
-    days_in_quarter = get_days_in_quarter()  # Calculate the number of days in the quarter
-    y4 = [total_accesses / days_in_quarter] * len(x) if days_in_quarter else [0] * len(x)  # Average accesses per day for all departments
+def BarchartPlot(app, counts=None):
+    # Authorised accesses per department, all four charts from one pass over the rollup
+    if counts is None:
+        counts = aggregation.department_counts(app)
 
-    print("Accesses Today:", y1)
-    print("Accesses This Week:", y2)
-    print("Accesses This Quarter:", y3)
-    print("Average Accesses per Day This Quarter:", y4)
+    x = counts['departments']
+    y1 = counts['today']      # Number of accesses today
+    y2 = counts['week']       # Number of accesses this week
+    y3 = counts['quarter']    # Total number of accesses this quarter
+    y4 = counts['per_day']    # Average accesses per day so far this quarter
+
+    app.logger.debug("Accesses today: %d, this week: %d, this quarter: %d, average per day this quarter: %.1f",
+                     y1.sum(), y2.sum(), y3.sum(), y4.sum())
 
     # Create the figure for the bar chart
     fig = Figure(figsize=(10, 8), dpi=100)
@@ -87,24 +58,238 @@ def BarchartPlot(app):
     chart1.set_title('Accesses today')
     chart1.set_xlabel('Departments')
     chart1.set_ylabel('Authorised Accesses')
+    chart1.tick_params(axis='x', labelrotation=90)
 
     chart2 = fig.add_subplot(2, 2, 2)  # 2 rows, 2 columns, position 2
     chart2.bar(x, y2, color='red')
     chart2.set_title('Accesses this week')
     chart2.set_xlabel('Departments')
     chart2.set_ylabel('Authorised Accesses')
+    chart2.tick_params(axis='x', labelrotation=90)
 
     chart3 = fig.add_subplot(2, 2, 3)  # 2 rows, 2 columns, position 3
     chart3.bar(x, y3, color='purple')
     chart3.set_title('Accesses this quarter')
     chart3.set_xlabel('Departments')
     chart3.set_ylabel('Authorised Accesses')
+    chart3.tick_params(axis='x', labelrotation=90)
 
     chart4 = fig.add_subplot(2, 2, 4)  # 2 rows, 2 columns, position 4
     chart4.bar(x, y4, color='green')
     chart4.set_title('Average accesses / day')
     chart4.set_xlabel('Departments')
     chart4.set_ylabel('Authorised Accesses')
+    chart4.tick_params(axis='x', labelrotation=90)
 
     fig.tight_layout(pad=3)  # Adjust layout to prevent overlap
     return fig
+
+
+# Caching. Two levels: the counts are kept until the database's data_version moves
+# (or the day changes), so an unchanged database costs no queries at all.
+# Figures and PNGs are keyed on a digest of the counts themselves, so new
+# scans that don't change what's drawn don't mean re-rendering either, and
+# the PNG files on disk stay valid across processes.
+def _caches(app):
+    caches = app.extensions.get('dashboard_cache')
+    if caches is None:
+        size = app.config.get('DASHBOARD_CACHE_SIZE', 8)
+        caches = app.extensions['dashboard_cache'] = {
+            'counts': LRUCache(size),
+            'figures': LRUCache(size),
+            'images': LRUCache(size),
+        }
+    return caches
+
+
+def dashboard_counts(app):
+    """ aggregation.department_counts(app), cached until the data changes """
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    key = (data_version(app), today)
+    return _caches(app)['counts'].get_or_build(key, lambda: aggregation.department_counts(app, today=today))
+
+
+def counts_digest(counts):
+    digest = hashlib.sha1()
+    for name in ('today', 'week', 'quarter', 'per_day'):
+        digest.update(counts[name].tobytes())
+    digest.update('\0'.join(counts['departments']).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def dashboard_figure(app):
+    """
+    The dashboard Figure, only re-rendered when the counts change.
+    The same Figure object is handed out each time, so embed it in one canvas at a time.
+    """
+    counts = dashboard_counts(app)
+    return _caches(app)['figures'].get_or_build(counts_digest(counts), lambda: BarchartPlot(app, counts))
+
+
+def dashboard_digest(app):
+    """ Changes exactly when the dashboard would look different; good for an ETag """
+    return counts_digest(dashboard_counts(app))
+
+
+# The cached dashboard Figure is shared, and matplotlib can't draw one Figure from two threads at once
+_render_lock = threading.Lock()
+
+
+def render_figure(fig, fmt='png'):
+    """ A Figure as PNG or SVG bytes, through the Agg (or SVG) backend; no GUI needed """
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def dashboard_image(app, fmt='png'):
+    """
+    The dashboard as PNG or SVG bytes. With DASHBOARD_CACHE_DIR set, they are
+    also kept on disk (the newest DASHBOARD_CACHE_SIZE files), so other
+    processes showing the same counts don't render them again.
+    """
+    digest = dashboard_digest(app)
+    directory = app.config.get('DASHBOARD_CACHE_DIR')
+
+    def render():
+        if directory:
+            path = os.path.join(directory, f'dashboard_{digest}.{fmt}')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    return f.read()
+
+        figure = dashboard_figure(app)
+        with _render_lock:
+            image = render_figure(figure, fmt)
+
+        if directory:
+            _store_image(directory, path, image, app.config.get('DASHBOARD_CACHE_SIZE', 8))
+        return image
+
+    return _caches(app)['images'].get_or_build((digest, fmt), render)
+
+
+def _store_image(directory, path, image, keep):
+    os.makedirs(directory, exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(image)
+    os.replace(temporary, path)
+
+    # Least recently written go first
+    files = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.startswith('dashboard_') and not entry.name.endswith('.tmp')),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in files[:-keep]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass    # Another process got there first
+
+
+def dashboard_cache_stats(app):
+    return {name: cache.stats() for name, cache in _caches(app).items()}
+
+
+# Live refresh: only accessLog rows above the last id seen, tagged with the
+# charts they count towards. ids only ever grow, and SQLite commits one
+# writer at a time, so nothing can appear below the mark later. NULLs count
+# as 0, as in the rollups, since numpy can't take them.
+NEW_ACCESSES_QUERY = """
+    SELECT a.id,
+           COALESCE(u.department_id, 0),
+           COALESCE(a.is_authorised, 0),
+           COALESCE(date(a.accessed) = :today, 0),
+           COALESCE(date(a.accessed) >= :week_start AND date(a.accessed) < :week_end, 0),
+           COALESCE(date(a.accessed) >= :quarter_start AND date(a.accessed) < :quarter_end, 0)
+    FROM accessLog a LEFT JOIN users u ON u.RFID_key = a.RFID_key
+    WHERE a.id > :last_id
+    ORDER BY a.id
+    LIMIT :limit
+"""
+LIVE_BATCH = 50_000     # Rows folded in per poll, so a big import can't stall the GUI
+
+
+class LiveDashboard:
+    """
+    A dashboard Figure of its own (never the cached one) whose counts are
+    kept current by polling for new accessLog rows, and whose bars are
+    updated in place, so a refresh costs in proportion to the new scans.
+    Counts are re-read from the rollups when the UTC day changes.
+
+    poll() only touches the database, so it can run on a worker thread;
+    redraw() touches the Figure and belongs on the GUI thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._baseline()
+        self.figure = BarchartPlot(app, self.counts)
+
+    def _baseline(self):
+        self.today = datetime.datetime.now(datetime.timezone.utc).date()
+        self.week = aggregation.week_bounds(self.today)
+        self.quarter = aggregation.quarter_bounds(self.today)
+
+        with self.app.app_context():
+            db = get_db()
+            # The counts and the high-water mark have to come from the same snapshot
+            db.execute("BEGIN")
+            try:
+                self.last_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM accessLog").fetchone()[0]
+                self.counts = aggregation.count_departments(db, today=self.today)
+            finally:
+                db.rollback()
+
+        ids = self.counts['department_ids']
+        self.bar_of = np.full(ids.max(initial=0) + 1, -1)
+        self.bar_of[ids] = np.arange(len(ids))
+
+    def poll(self):
+        """ Count scans logged since the last poll. Returns True if the charts need redrawing """
+        if datetime.datetime.now(datetime.timezone.utc).date() != self.today:
+            self._baseline()
+            return True
+
+        with self.app.app_context():
+            cursor = get_db().cursor()
+            cursor.row_factory = None
+            rows = cursor.execute(NEW_ACCESSES_QUERY, {
+                'today': self.today.isoformat(),
+                'week_start': self.week[0].isoformat(),
+                'week_end': self.week[1].isoformat(),
+                'quarter_start': self.quarter[0].isoformat(),
+                'quarter_end': self.quarter[1].isoformat(),
+                'last_id': self.last_id,
+                'limit': LIVE_BATCH,
+            }).fetchall()
+
+        if not rows:
+            return False
+
+        ids, department, authorised, in_today, in_week, in_quarter = np.array(rows, dtype=np.int64).T
+        self.last_id = int(ids[-1])
+
+        # Departments added since the baseline have no bar yet; same as no department
+        department[department >= len(self.bar_of)] = 0
+        bar = self.bar_of[department]
+        counted = (bar >= 0) & (authorised == 1)
+
+        bars = len(self.counts['departments'])
+        for name, in_period in (('today', in_today), ('week', in_week), ('quarter', in_quarter)):
+            self.counts[name] = self.counts[name] + np.bincount(bar[counted & (in_period == 1)], minlength=bars)
+
+        elapsed = (self.today - self.quarter[0]).days + 1
+        self.counts['per_day'] = self.counts['quarter'] / elapsed
+        return bool(counted.any())
+
+    def redraw(self):
+        """ Move the existing bars to the current counts and have the canvas repaint when idle """
+        for chart, name in zip(self.figure.axes, ('today', 'week', 'quarter', 'per_day')):
+            for bar, height in zip(chart.containers[0], self.counts[name]):
+                bar.set_height(height)
+            chart.relim()
+            chart.autoscale_view()
+
+        self.figure.canvas.draw_idle()
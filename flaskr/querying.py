@@ -1,45 +1,620 @@
+import re
 import sqlite3
-from flask import current_app
-from flaskr.db import get_db
+import sys
+import threading
+import time
+from contextlib import closing, contextmanager, nullcontext
 
-import sqlite3
+import click
 from flask import current_app
-from flaskr.db import get_db
+from flaskr import partitions
+from flaskr.cache import LRUCache
+from flaskr.db import data_version, get_db
 
-def execute_sql_query(query, userid):
-    """Execute the user-provided SQL query."""
-    with current_app.app_context():
-        db = get_db()
+REDACTED = "[REDACTED INFORMATION]"
+
+# (table, column) pairs nobody sees through the console, admin included
+PROTECTED_COLUMNS = {('users', 'password')}
+
+# What a non-admin's statement may do: read, and nothing else
+READ_ONLY_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+# Functions whose result isn't decided by the data alone, so neither is a
+# query calling them: its rows are never cached
+VOLATILE_FUNCTIONS = {
+    'random', 'randomblob', 'changes', 'total_changes', 'last_insert_rowid',
+    'current_date', 'current_time', 'current_timestamp',
+}
+# ...and these only when asked about 'now', which is also what they default to
+TIME_FUNCTIONS = {'date', 'time', 'datetime', 'julianday', 'unixepoch', 'strftime', 'timediff'}
+
+
+class QueryPolicy:
+    """
+    What one user's statement may do, enforced by SQLite itself while it
+    prepares the statement (Connection.set_authorizer) rather than by
+    looking for keywords in the SQL, so comments, case and subqueries
+    can't get round it.
+
+    Only admin may write. Protected columns read as NULL for everyone,
+    wherever they appear in the statement (WHERE clauses included), and
+    result columns named after one are shown as REDACTED.
+    """
+
+    def __init__(self, userid):
+        self.admin = user_role(userid) == 'admin'
+        self.denied = None          # The action SQLite was refused, if any
+        self.protected = set()      # Names of protected columns the statement read
+        self.functions = set()      # Names of the functions it calls
+
+    def __call__(self, action, arg1, arg2, db_name, source):
+        if action == sqlite3.SQLITE_READ and ((arg1 or '').lower(), (arg2 or '').lower()) in PROTECTED_COLUMNS:
+            self.protected.add(arg2.lower())
+            return sqlite3.SQLITE_IGNORE
+        if action == sqlite3.SQLITE_FUNCTION:
+            self.functions.add(arg2.lower())
+
+        if self.admin or action in READ_ONLY_ACTIONS:
+            return sqlite3.SQLITE_OK
+
+        self.denied = action
+        return sqlite3.SQLITE_DENY
+
+    def execute(self, db, query, params=()):
+        """ Prepare and run query on db under this policy """
+        self.denied = None
+        self.protected.clear()
+        self.functions.clear()
 
-        # Prevent UPDATE queries
-        if "UPDATE" in query.upper() and userid.lower() != 'admin':
-            raise Exception("UPDATE queries are NOT allowed for security reasons.")
+        # Plain tuples straight from SQLite rather than copying every sqlite3.Row
+        cursor = db.cursor()
+        cursor.row_factory = None
 
+        # Only consulted while preparing, so the pooled connection can go
+        # straight back to trusting everyone else's statements. Putting back
+        # one that allows everything, rather than None, also expires what was
+        # prepared under the policy, or the statement cache would hand the
+        # next caller the same query with its protected columns still NULL
+        db.set_authorizer(self)
         try:
-            # Execute the query
-            cursor = db.execute(query)
-            
-            # If it's a SELECT query, fetch the results
-            if query.strip().upper().startswith("SELECT"):
-                results = cursor.fetchall()
-
-                # Convert each sqlite3.Row object to a tuple
-                results = [tuple(row) for row in results] 
-
-                # Restrict password view (prevent 'scrypt:...' from showing)
-                for i in range(len(results)):
-                    for j in range(len(results[i])):
-                        value = results[i][j]
-                        if isinstance(value, str) and value.strip().startswith("scrypt"):
-                            results[i] = results[i][:j] + ("[REDACTED INFORMATION]",) + results[i][j+1:] 
-
-            else:
-                # For non-SELECT queries, commit changes and return the number of affected rows
+            return cursor.execute(query, params)
+        except sqlite3.DatabaseError:
+            if self.denied is not None:
+                raise Exception("Only admin may change the database; other users can only run SELECT queries.")
+            raise
+        finally:
+            db.set_authorizer(_allow_all)
+
+    def redacted_columns(self, description):
+        """ Positions of the result columns to show as REDACTED, decided once per result set """
+        if not self.protected:
+            return []
+        return [i for i, column in enumerate(description) if column[0].lower() in self.protected]
+
+    def deterministic(self, query):
+        """ Whether the statement last run, query, returns the same rows for as long as the data is the same """
+        if self.functions & VOLATILE_FUNCTIONS:
+            return False
+        if self.functions & TIME_FUNCTIONS:
+            return not re.search(r"'now'|\b(?:date|time|datetime|julianday|unixepoch)\s*\(\s*\)",
+                                 normalize_sql(query), re.IGNORECASE)
+        return True
+
+
+def _allow_all(action, arg1, arg2, db_name, source):
+    return sqlite3.SQLITE_OK
+
+
+def user_role(userid):
+    return 'admin' if userid.lower() == 'admin' else 'analyst'
+
+
+def _redact(rows, columns):
+    if columns:
+        for i, row in enumerate(rows):
+            row = list(row)
+            for column in columns:
+                row[column] = REDACTED
+            rows[i] = tuple(row)
+    return rows
+
+
+class QueryBudget:
+    """
+    How long one console query may run and how many rows it may return,
+    and the handle for cancelling it from another thread (the GUI's Cancel
+    button). timeout and max_rows default to QUERY_TIMEOUT and
+    QUERY_MAX_ROWS.
+
+    SQLite calls back every PROGRESS_STEPS virtual machine instructions
+    while the query runs, whether it's preparing, scanning or sorting, and
+    the query is abandoned as soon as that finds it over time or
+    cancelled; cancel() also interrupt()s the connection so a statement
+    doesn't even finish its current batch of steps.
+
+    It also records what the query cost: wall time, time spent in each
+    stage, rows read and VM steps (to the nearest PROGRESS_STEPS). The
+    EXPLAIN QUERY PLAN costs a second prepare, so it's only taken with
+    profile set or when the query was slow. A query answered from the
+    result cache never runs, so its budget stays empty (wall is None).
+    """
+
+    PROGRESS_STEPS = 1000
+
+    def __init__(self, timeout=None, max_rows=None, profile=False):
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.profile = profile
+        self.rows = 0
+        self.stopped = None         # Why the query was abandoned, if it was
+
+        self.steps = 0
+        self.timings = {'execute': 0.0, 'fetch': 0.0, 'redact': 0.0}
+        self.plan = []
+        self.wall = None
+        self.started = None
+
+        self._deadline = None
+        self._db = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.stopped == "cancelled"
+
+    def cancel(self):
+        with self._lock:
+            self.stopped = "cancelled"
+            if self._db is not None:
+                self._db.interrupt()
+
+    @contextmanager
+    def running(self, db):
+        """ Hold db to this budget for the length of the block """
+        config = current_app.config
+        self.timeout = self.timeout or config['QUERY_TIMEOUT']
+        self.max_rows = self.max_rows or config['QUERY_MAX_ROWS']
+        self.started = time.perf_counter()
+        self._deadline = time.monotonic() + self.timeout
+
+        with self._lock:
+            if self.stopped:
+                raise Exception("Query cancelled.")
+            self._db = db
+        db.set_progress_handler(self._progress, self.PROGRESS_STEPS)
+        try:
+            yield self
+        finally:
+            # Unhooked before db goes back to the pool, so a late cancel()
+            # can't interrupt whoever uses it next
+            with self._lock:
+                self._db = None
+            db.set_progress_handler(None, 0)
+
+    @contextmanager
+    def timed(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] += time.perf_counter() - started
+
+    def fetch(self, cursor, size):
+        """ cursor.fetchmany(size), counted against max_rows """
+        with self.timed('fetch'):
+            rows = cursor.fetchmany(size)
+        self.rows += len(rows)
+        if self.rows > self.max_rows:
+            self.stopped = "row limit"
+            raise Exception(f"Query stopped after {self.max_rows:,} rows. Add a LIMIT or a narrower WHERE.")
+        return rows
+
+    def error(self, e):
+        """ The exception to show for sqlite3 error e raised inside running() """
+        if self.stopped == "cancelled":
+            return Exception("Query cancelled.")
+        if self.stopped == "timeout":
+            return Exception(f"Query took longer than {self.timeout}s and was stopped.")
+        return Exception(f"SQL error: {e}")
+
+    def _progress(self):
+        self.steps += self.PROGRESS_STEPS
+        if self.stopped is None and time.monotonic() > self._deadline:
+            self.stopped = "timeout"
+        # Non-zero abandons the statement with "interrupted"
+        return self.stopped is not None
+
+
+def explain(db, policy, query, params=()):
+    """ query's EXPLAIN QUERY PLAN, indented to show its tree, or [] if it can't be explained """
+    try:
+        rows = policy.execute(db, f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+    except Exception:
+        # Refused, not valid SQL, or a statement with no plan (PRAGMA, say)
+        return []
+
+    depth = {0: -1}
+    plan = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node] + detail)
+    return plan
+
+
+@contextmanager
+def _profiled(db, budget, policy, userid, query, params=()):
+    """ Run the block under budget, then log the query with its plan if it was slow """
+    outcome = 'ok'
+    try:
+        with budget.running(db):
+            yield
+    except Exception:
+        outcome = budget.stopped or 'error'
+        raise
+    finally:
+        if budget.started is not None:
+            budget.wall = time.perf_counter() - budget.started
+            slow = budget.wall * 1000 >= current_app.config['SLOW_QUERY_MS']
+            if slow or budget.profile:
+                budget.plan = explain(db, policy, query, params)
+            if slow:
+                log_slow_query(userid, query, budget, outcome)
+
+
+def stream_sql_query(query, userid, chunk_size=None, budget=None):
+    """
+    Execute the user-provided SQL query, yielding its rows in lists of up to
+    chunk_size (QUERY_CHUNK_ROWS by default) instead of all at once, so only
+    one chunk is ever held in memory. A statement that returns no rows is
+    committed and yields nothing; one that writes and returns rows (INSERT
+    ... RETURNING) is committed once its cursor is closed. budget limits
+    and cancels it.
+
+    It reads through the caller's app context, so iterate it (or close it)
+    before that context ends.
+    """
+    policy = QueryPolicy(userid)
+    budget = budget or QueryBudget()
+
+    chunk_size = chunk_size or current_app.config['QUERY_CHUNK_ROWS']
+    db = get_db()
+
+    with _access_log_view(db, query), _profiled(db, budget, policy, userid, query):
+        try:
+            with budget.timed('execute'):
+                cursor = policy.execute(db, query)
+            if cursor.description is None:
                 db.commit()
-                results = f"{cursor.rowcount} rows affected."
+                return
 
+            redacted = policy.redacted_columns(cursor.description)
+            try:
+                while chunk := budget.fetch(cursor, chunk_size):
+                    with budget.timed('redact'):
+                        chunk = _redact(chunk, redacted)
+                    yield chunk
+            finally:
+                cursor.close()
+                _commit_if_open(db)
         except sqlite3.Error as e:
-            raise Exception(f"SQL error: {e}")
-        
-    return results
+            raise budget.error(e)
+
+
+def execute_sql_query(query, userid, limit=None, offset=0, budget=None):
+    """
+    Execute the user-provided SQL query.
+    Returns its rows (only limit of them, after skipping offset, if given),
+    or "N rows affected." for statements that don't return rows.
+    Rows come from the result cache when nothing has changed since the same
+    query was last run; treat them as read-only. Statements that write, or
+    whose rows depend on more than the data (random(), datetime('now')),
+    are never cached. budget limits and cancels the query when it does have to
+    run.
+    """
+    key = ('query', normalize_sql(query), user_role(userid), limit, offset)
+    return _cached(key, lambda: _execute_sql_query(query, userid, limit, offset, budget or QueryBudget()))
+
+
+def _execute_sql_query(query, userid, limit, offset, budget):
+    policy = QueryPolicy(userid)
+
+    with current_app.app_context():
+        db = get_db()
+        chunk_size = current_app.config['QUERY_CHUNK_ROWS']
+
+        with _access_log_view(db, query), _profiled(db, budget, policy, userid, query):
+            try:
+                with budget.timed('execute'):
+                    cursor = policy.execute(db, query)
+                deterministic = policy.deterministic(query)
+
+                # For non-SELECT queries, commit changes and return the number of affected rows
+                if cursor.description is None:
+                    db.commit()
+                    return f"{cursor.rowcount} rows affected.", False
+
+                redacted = policy.redacted_columns(cursor.description)
+                results = []
+                wrote = False
+                try:
+                    # Skip to offset a chunk at a time so earlier pages are never held
+                    while offset > 0:
+                        skipped = budget.fetch(cursor, min(offset, chunk_size))
+                        if not skipped:
+                            break
+                        offset -= len(skipped)
+
+                    while limit is None or len(results) < limit:
+                        size = chunk_size if limit is None else min(chunk_size, limit - len(results))
+                        chunk = budget.fetch(cursor, size)
+                        if not chunk:
+                            break
+                        with budget.timed('redact'):
+                            results.extend(_redact(chunk, redacted))
+                finally:
+                    cursor.close()
+                    wrote = _commit_if_open(db)
+            except sqlite3.Error as e:
+                raise budget.error(e)
+
+    return results, deterministic and not wrote
+
+
+def _commit_if_open(db):
+    """
+    Commit the transaction a statement returning rows left open, as INSERT
+    ... RETURNING does (a SELECT never opens one), rather than leave the
+    pool to roll it back. Returns whether there was one.
+    """
+    if db.in_transaction:
+        db.commit()
+        return True
+    return False
+
+
+def _access_log_view(db, query):
+    """
+    partitions.access_log_view() if query reads accessLogAll, so the console
+    can see the last ACCESS_LOG_VIEW_MONTHS archived months too; nothing to
+    set up otherwise. Queries must close their cursors inside it.
+    """
+    if re.search(rf"\b{partitions.ACCESS_LOG_VIEW}\b", query, re.IGNORECASE):
+        return partitions.access_log_view(db)
+    return nullcontext()
+
+
+def page_key(db, table):
+    """
+    The real name of table and the INTEGER PRIMARY KEY column it can be
+    paged by, as (table, column, position in SELECT *). accessLogAll pages
+    by accessLog's id.
+    """
+    if table.lower() == partitions.ACCESS_LOG_VIEW.lower():
+        return partitions.ACCESS_LOG_VIEW, 'id', 0
+
+    row = db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE", (table,)
+    ).fetchone()
+    if row is None:
+        raise Exception(f"No such table: {table}")
+
+    table = row['name']
+    for column in db.execute(f'PRAGMA table_info("{table}")'):
+        if column['pk'] == 1 and column['type'].upper() == 'INTEGER':
+            return table, column['name'], column['cid']
+    raise Exception(f"{table} has no INTEGER PRIMARY KEY to page by")
+
+
+def fetch_table_page(table, userid, after=None, page_size=None, budget=None):
+    """
+    One page of SELECT * FROM table in key order, found through the primary
+    key index rather than by reading past the rows before it (keyset
+    pagination), so every page costs the same however deep it is.
+    Returns (rows, next_after): pass next_after back as `after` for the
+    following page; it is None on the last one. Cached and limited like
+    execute_sql_query.
+    """
+    page_size = page_size or current_app.config['QUERY_PAGE_SIZE']
+    key = ('table', table.lower(), user_role(userid), after, page_size)
+    return _cached(key, lambda: _fetch_table_page(table, userid, after, page_size, budget or QueryBudget()))
+
+
+def _fetch_table_page(table, userid, after, page_size, budget):
+    with current_app.app_context():
+        db = get_db()
+        table, key, position = page_key(db, table)
+
+        where = "" if after is None else f'WHERE "{key}" > :after'
+        query = f'SELECT * FROM "{table}" {where} ORDER BY "{key}" LIMIT :limit'
+        params = {'after': after, 'limit': page_size + 1}
+
+        policy = QueryPolicy(userid)
+        with _access_log_view(db, table), _profiled(db, budget, policy, userid, query, params):
+            try:
+                with budget.timed('execute'):
+                    cursor = policy.execute(db, query, params)
+                try:
+                    rows = budget.fetch(cursor, page_size + 1)
+                    with budget.timed('redact'):
+                        rows = _redact(rows, policy.redacted_columns(cursor.description))
+                finally:
+                    cursor.close()
+            except sqlite3.Error as e:
+                raise budget.error(e)
+
+    # The extra row only says whether there's another page
+    if len(rows) > page_size:
+        del rows[page_size:]
+        return (rows, rows[-1][position]), True
+    return (rows, None), True
+
+
+# Results of analysts' queries, keyed on the database's data_version so any
+# commit (esp32.py appending to accessLog included) makes them miss
+
+# Quoted strings and names, which are kept as they are, and comments
+SQL_LITERALS_AND_COMMENTS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?(?:\*/|\Z))""", re.DOTALL)
+
+
+def normalize_sql(query):
+    """
+    query with comments dropped, runs of whitespace collapsed, keywords and
+    names lowercased and trailing semicolons dropped, leaving quoted strings
+    alone, so trivially different spellings share a cache entry.
+    """
+    pieces, code = [], []
+    for i, part in enumerate(SQL_LITERALS_AND_COMMENTS.split(query)):
+        if i % 2 and part[0] in "'\"":
+            pieces.append(re.sub(r"\s+", " ", "".join(code)).lower())
+            pieces.append(part)
+            code = []
+        else:
+            # A comment separates what's either side of it like a space
+            code.append(" " if i % 2 else part)
+    pieces.append(re.sub(r"\s+", " ", "".join(code)).lower())
+    return "".join(pieces).strip().rstrip("; ")
+
+
+def result_size(result):
+    """ Rough bytes held by a cached result: the rows, their tuples and their values """
+    rows = result[0] if isinstance(result, tuple) else result
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+def _result_cache(app):
+    cache = app.extensions.get('query_cache')
+    if cache is None:
+        cache = app.extensions['query_cache'] = LRUCache(
+            app.config.get('QUERY_CACHE_SIZE', 64),
+            app.config.get('QUERY_CACHE_BYTES'),
+            result_size
+        )
+    return cache
+
+
+def _cached(key, run):
+    """ The cached result for key, or run()'s, which returns (result, whether to cache it) """
+    app = current_app._get_current_object()
+    cache = _result_cache(app)
+    key = (data_version(app),) + key
+
+    result = cache.get(key)
+    if result is None:
+        result, cacheable = run()
+        if cacheable:
+            cache.put(key, result)
+    return result
+
+
+def query_cache_stats(app):
+    return _result_cache(app).stats()
+
+
+# Queries that took SLOW_QUERY_MS or more. They go in a database of their
+# own: a write to the main one would move its data_version and throw away
+# every cached result, including the slow one just worth caching.
+SLOW_QUERY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slowQueries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    logged TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    username TEXT NOT NULL,
+    query TEXT NOT NULL,
+    outcome TEXT NOT NULL,          -- ok, error, timeout, cancelled or row limit
+    wall_ms REAL NOT NULL,
+    execute_ms REAL NOT NULL,
+    fetch_ms REAL NOT NULL,
+    redact_ms REAL NOT NULL,
+    rows INTEGER NOT NULL,
+    vm_steps INTEGER NOT NULL,
+    query_plan TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_slowqueries_logged ON slowQueries(logged);
+"""
+
+
+def _slow_query_log():
+    db = sqlite3.connect(current_app.config['SLOW_QUERY_LOG'], detect_types=sqlite3.PARSE_DECLTYPES)
+    db.row_factory = sqlite3.Row
+    db.executescript(SLOW_QUERY_SCHEMA)
+    return db
+
+
+def log_slow_query(userid, query, budget, outcome):
+    timings = budget.timings
+    try:
+        with closing(_slow_query_log()) as db, db:
+            db.execute(
+                "INSERT INTO slowQueries (username, query, outcome, wall_ms, execute_ms, fetch_ms, redact_ms, "
+                "rows, vm_steps, query_plan) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (userid, query, outcome, budget.wall * 1000, timings['execute'] * 1000,
+                 timings['fetch'] * 1000, timings['redact'] * 1000, budget.rows, budget.steps,
+                 "\n".join(budget.plan))
+            )
+    except sqlite3.Error as e:
+        # Losing a log entry is better than failing the query that was logged
+        current_app.logger.warning("Could not log slow query: %s", e)
+
+
+def slow_queries(limit=20):
+    """ The most recently logged slow queries, newest first """
+    with closing(_slow_query_log()) as db:
+        return db.execute("SELECT * FROM slowQueries ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+
+@click.command('slow-queries')
+@click.option('--limit', default=20, show_default=True, help='How many to show')
+def slow_queries_command(limit):
+    """ Show the most recent console queries that took SLOW_QUERY_MS or more """
+    for row in slow_queries(limit):
+        click.echo(f"{row['logged']}  {row['username']}  {row['wall_ms']:.0f} ms  {row['rows']} rows  "
+                   f"~{row['vm_steps']:,} steps  {row['outcome']}")
+        click.echo(f"    {row['query']}")
+        for line in row['query_plan'].splitlines():
+            click.echo(f"        {line}")
+
+
+def init_app(app):
+    app.cli.add_command(slow_queries_command)
+
+
+def fetch_access_log(start, end, where="", params=()):
+    """
+    Yield the accessLog rows with start <= accessed < end, wherever they now
+    live: each monthly partition the range touches (oldest first), then the
+    main table, which holds the open month and any late arrivals.
+    where is extra SQL ANDed onto the range, with params for its placeholders.
+
+    Partitions are attached one at a time, so any range can be read however
+    many months it spans (SQLite attaches at most 10 databases at once).
+    Like stream_sql_query(), it needs the caller's app context while it runs.
+    """
+    start, end = str(start), str(end)
+    condition = "accessed >= ? AND accessed < ?" + (f" AND ({where})" if where else "")
+    arguments = (start, end, *params)
+
+    db = get_db()
+
+    for partition in partitions.archived_partitions(start, end):
+        partitions.attach_partition(db, partition['month'])
+        try:
+            yield from _rows_then_close(db.execute(f"SELECT * FROM part.accessLog WHERE {condition}", arguments))
+        finally:
+            partitions.detach_partition(db)
+
+    yield from _rows_then_close(db.execute(f"SELECT * FROM main.accessLog WHERE {condition}", arguments))
+
 
+def _rows_then_close(cursor):
+    # Closed even when the caller stops early, so the partition under it can be detached
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
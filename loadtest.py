@@ -0,0 +1,321 @@
+"""
+Load test for the esp32.py ingest server, entirely on localhost.
+
+Starts the async ingest server in a child process (or a supervisor with
+--workers), then simulates a fleet of virtual ESP32 readers that send real
+payloads (<UID>,<GRANTED>,<MILLIS> lines, or binary frames with --binary)
+at a configurable rate and burst pattern. At the end it reports:
+
+    sustained   events logged per second
+    send->log   p50/p99 from a reader writing an event to the sink writing it
+    send->ack   p50/p99 from a reader writing an event to reading its ack
+    dropped     events sent but never logged
+    malformed   events the server rejected (NAK)
+
+Exits non-zero if --min-rate, --max-p99 or --max-dropped are not met, so
+it can gate a release.
+
+    python loadtest.py --readers 200 --rate 5 --duration 30 --pattern burst
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+
+import esp32
+
+
+# ── Server side ──────────────────────────────────────────────
+class NullWriter(esp32.BatchWriter):
+    """Sink that throws events away, to measure the server on its own."""
+    path = os.devnull
+
+    def _write_batch(self, events):
+        pass
+
+
+class RecordingSink(esp32.BatchWriter):
+    """
+    Wraps a real sink and notes when each event reached it.
+    time.monotonic() is shared between processes on Linux, so the readers'
+    send times can be matched against these afterwards.
+    """
+
+    def __init__(self, inner: esp32.BatchWriter, **kwargs):
+        self.inner = inner
+        self.path = inner.path
+        self.records = []
+        super().__init__(**kwargs)
+
+    def close(self):
+        super().close()
+        self.inner.close()
+
+    def _write_batch(self, events):
+        self.inner._write_batch(events)
+
+        logged_at = time.monotonic()
+        self.records.extend((uid, millis, logged_at) for _, uid, _, millis, _ in events)
+
+
+def open_recording_sink(kind: str, directory: str) -> RecordingSink:
+    if kind == "null":
+        inner = NullWriter()
+    elif kind == "csv":
+        inner = esp32.LogWriter(os.path.join(directory, "access_log.csv"))
+    else:
+        from flaskr.db import migrate
+
+        path = os.path.join(directory, "flaskr.sqlite")
+        db = sqlite3.connect(path)
+        migrate(db)
+        db.close()
+        inner = esp32.AccessLogWriter(path)
+    return RecordingSink(inner)
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def serve(conn, sink_kind: str, workers: int):
+    """Child process: run the ingest server until told to stop, then send back the records."""
+    # Rejected events are expected when --malformed-rate is set
+    logging.getLogger("esp32").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        sink = open_recording_sink(sink_kind, directory)
+
+        async def run():
+            server = await esp32.start_async_server(sink, "127.0.0.1", 0)
+            conn.send(server.sockets[0].getsockname()[1])
+
+            await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+            server.close()
+            await server.wait_closed()
+
+        if workers:
+            port = free_port()
+            supervisor = esp32.Supervisor(sink, workers, "127.0.0.1", port)
+            supervisor.start()
+            conn.send(port)
+
+            while not conn.poll(esp32.RESTART_DELAY):
+                supervisor.check_workers()
+            conn.recv()
+            supervisor.stop()
+        else:
+            asyncio.run(run())
+        sink.close()
+
+    conn.send(sink.records)
+
+
+# ── Virtual readers ──────────────────────────────────────────
+class FleetStats:
+    def __init__(self):
+        self.sent_at = {}        # (uid, millis) -> time.monotonic() at send
+        self.ack_latency = []
+        self.acked = 0
+        self.malformed = 0
+        self.bad_sent = 0
+        self.errors = 0
+
+
+def delays(pattern: str, rate: float, burst_size: int, burst_every: float, rng: random.Random):
+    """Seconds to wait before each event, forever."""
+    while True:
+        if pattern == "steady":
+            yield 1 / rate
+        elif pattern == "poisson":
+            yield rng.expovariate(rate)
+        else:
+            # Shift change: a tight burst, then the steady rate until the next one
+            for _ in range(burst_size):
+                yield 0
+            for _ in range(max(1, int(burst_every * rate))):
+                yield 1 / rate
+
+
+def make_event(uid: str, millis: int, binary: bool, malformed: bool) -> bytes:
+    if malformed:
+        return b"not,a,valid,payload\n"
+    if binary:
+        return esp32.encode_frame(uid, True, millis, 0)
+    return f"{uid},1,{millis}\n".encode()
+
+
+async def read_acks(reader: asyncio.StreamReader, pending: list, stats: FleetStats):
+    """Match in-order acks against the send times of this connection's events."""
+    next_ack = 0
+    while line := await reader.readline():
+        now = time.monotonic()
+        stats.ack_latency.append(now - pending[next_ack])
+        next_ack += 1
+
+        if line.startswith(b"ACK"):
+            stats.acked += 1
+        else:
+            stats.malformed += 1
+
+
+async def virtual_reader(index: int, port: int, args, deadline: float, stats: FleetStats):
+    rng = random.Random(index)
+    uid = f"{index:08X}"
+    millis = 0
+    pending = []
+
+    # Spread the readers' first events over one interval
+    await asyncio.sleep(rng.random() / args.rate)
+
+    reader = writer = ack_task = None
+    try:
+        for delay in delays(args.pattern, args.rate, args.burst_size, args.burst_every, rng):
+            if delay:
+                await asyncio.sleep(delay)
+            if time.monotonic() >= deadline:
+                break
+
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                pending = []
+                ack_task = asyncio.create_task(read_acks(reader, pending, stats))
+
+            millis += 1
+            malformed = rng.random() < args.malformed_rate
+            writer.write(make_event(uid, millis, args.binary, malformed))
+
+            now = time.monotonic()
+            pending.append(now)
+            if malformed:
+                stats.bad_sent += 1
+            else:
+                stats.sent_at[(uid, str(millis))] = now
+
+            if args.connect_per_event:
+                writer.write_eof()
+                await ack_task
+                writer.close()
+                writer = None
+            else:
+                await writer.drain()
+
+    except OSError:
+        stats.errors += 1
+    finally:
+        if writer is not None:
+            writer.write_eof()
+            await ack_task
+            writer.close()
+
+
+async def run_fleet(port: int, args) -> tuple[FleetStats, float, float]:
+    stats = FleetStats()
+    started = time.monotonic()
+    deadline = started + args.duration
+
+    await asyncio.gather(*(
+        virtual_reader(i, port, args, deadline, stats) for i in range(args.readers)
+    ))
+    return stats, started, time.monotonic()
+
+
+# ── Report ───────────────────────────────────────────────────
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(stats: FleetStats, records: list, started: float, args) -> bool:
+    log_latency = []
+    logged = 0
+    last_logged = started
+    for uid, millis, logged_at in records:
+        sent = stats.sent_at.pop((uid, millis), None)
+        if sent is not None:
+            logged += 1
+            log_latency.append(logged_at - sent)
+            last_logged = max(last_logged, logged_at)
+
+    sent = logged + len(stats.sent_at)
+    dropped = len(stats.sent_at)
+    rate = logged / (last_logged - started) if last_logged > started else 0.0
+    p50, p99 = percentile(log_latency, 50) * 1000, percentile(log_latency, 99) * 1000
+
+    print(f"readers        {args.readers} ({args.pattern}, "
+          f"{'connect per event' if args.connect_per_event else 'keep-alive'}, "
+          f"{'binary' if args.binary else 'csv'}, {args.sink} sink)")
+    print(f"sent           {sent + stats.bad_sent}")
+    print(f"logged         {logged}")
+    print(f"dropped        {dropped}")
+    print(f"malformed      {stats.malformed} rejected of {stats.bad_sent} injected")
+    print(f"conn. errors   {stats.errors}")
+    print(f"sustained      {rate:,.0f} events/s")
+    print(f"send->log      p50 {p50:.1f} ms   p99 {p99:.1f} ms")
+    print(f"send->ack      p50 {percentile(stats.ack_latency, 50) * 1000:.1f} ms   "
+          f"p99 {percentile(stats.ack_latency, 99) * 1000:.1f} ms")
+
+    failures = []
+    if args.min_rate is not None and rate < args.min_rate:
+        failures.append(f"sustained rate {rate:,.0f}/s is below {args.min_rate:,.0f}/s")
+    if args.max_p99 is not None and p99 > args.max_p99:
+        failures.append(f"send->log p99 {p99:.1f} ms is above {args.max_p99} ms")
+    if dropped > args.max_dropped:
+        failures.append(f"{dropped} events dropped (allowed {args.max_dropped})")
+
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the ESP32 ingest server on localhost")
+    parser.add_argument("--readers", type=int, default=100, help="Virtual readers to simulate")
+    parser.add_argument("--rate", type=float, default=2.0, help="Events per second per reader")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to send for")
+    parser.add_argument("--pattern", choices=("steady", "poisson", "burst"), default="steady")
+    parser.add_argument("--burst-size", type=int, default=20, help="Events per reader in each burst")
+    parser.add_argument("--burst-every", type=float, default=5.0, help="Seconds between bursts")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of events sent malformed")
+    parser.add_argument("--binary", action="store_true", help="Send binary frames instead of CSV lines")
+    parser.add_argument("--connect-per-event", action="store_true",
+                        help="Open a new connection per event, like the old firmware")
+    parser.add_argument("--sink", choices=("null", "csv", "sqlite"), default="null",
+                        help="Where the server writes events (files go in a temporary directory)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Run the server in supervisor mode with this many workers (0: one async process)")
+    parser.add_argument("--min-rate", type=float, default=None, help="Fail below this many events/s")
+    parser.add_argument("--max-p99", type=float, default=None, help="Fail above this send->log p99 (ms)")
+    parser.add_argument("--max-dropped", type=int, default=0, help="Fail above this many dropped events")
+    args = parser.parse_args()
+
+    conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(child_conn, args.sink, args.workers))
+    server.start()
+
+    try:
+        port = conn.recv()
+        stats, started, _ = asyncio.run(run_fleet(port, args))
+    finally:
+        conn.send("stop")
+
+    records = conn.recv()
+    server.join()
+
+    sys.exit(0 if report(stats, records, started, args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+The dashboard's hot queries must be answered from an index, never by
+scanning accessLog or its rollups. Fails as soon as a schema or query
+change makes SQLite fall back to a full scan.
+"""
+import sqlite3
+
+import pytest
+
+from flaskr.db import migrate
+from flaskr.plotting import DASHBOARD_QUERIES, LIVE_BATCH, NEW_ACCESSES_QUERY
+
+# The big tables, and the alias the live poll gives accessLog
+SCANNED_TABLES = ('accessLog', 'accessHourly', 'accessDaily', 'a')
+
+HOT_QUERIES = {
+    **DASHBOARD_QUERIES,
+    'live_poll': (NEW_ACCESSES_QUERY, {
+        'last_id': 0, 'limit': LIVE_BATCH, 'today': '2000-01-01',
+        'week_start': '2000-01-01', 'week_end': '2000-01-08',
+        'quarter_start': '2000-01-01', 'quarter_end': '2000-04-01',
+    }),
+    'access_window': (
+        "SELECT * FROM accessLog WHERE accessed >= ? AND accessed < ?",
+        ('2000-01-01', '2000-02-01'),
+    ),
+}
+
+
+@pytest.fixture(scope='module')
+def db():
+    db = sqlite3.connect(':memory:')
+    migrate(db)
+    yield db
+    db.close()
+
+
+def is_full_scan(detail, table):
+    # "SCAN accessLog", or "SCAN accessLog USING COVERING INDEX ..." (every row of an index)
+    return detail == f'SCAN {table}' or detail.startswith(f'SCAN {table} ')
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_query_uses_an_index(db, name):
+    sql, params = HOT_QUERIES[name] if isinstance(HOT_QUERIES[name], tuple) else (HOT_QUERIES[name], ())
+    plan = [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+    scans = [detail for detail in plan for table in SCANNED_TABLES if is_full_scan(detail, table)]
+    assert not scans, f"{name} scans a whole table: {plan}"
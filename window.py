@@ -1,4 +1,5 @@
 import threading
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox
 
@@ -12,11 +13,14 @@ import flaskr
 
 
 WINDOW_SCALE = 3.5  # Should this be user configureable?
+LIVE_REFRESH_MS = 2000  # How often the dashboard checks for new scans when auto-refreshing
+LIVE_MAX_FAILURES = 5  # Polls in a row that may fail before auto-refresh gives up
 
 FONT = ("Segoe UI", 10)
 FONT_BOLD = ("Segoe UI", 10, "bold")
 FONT_LARGE = ("Segoe UI", 12)
 FONT_TITLE = ("Segoe UI", 14, "bold")
+FONT_MONO = ("Consolas", 9)
 
 # Colours
 COLOURS = {
@@ -42,10 +46,14 @@ COLOURS = {
 
 class ResultView:
     """
-    Wrapper around a scrollable Treeview.
+    Wrapper around a scrollable Treeview, one page of results at a time.
+    on_page(page) is called when the user asks for another page.
     """
 
-    def __init__(self, parent):
+    def __init__(self, parent, on_page=None):
+        self.on_page = on_page
+        self.page = 0
+
         self.container = ttk.Frame(parent, style="Card.TFrame")
         self.container.grid(
             row=2,
@@ -96,17 +104,41 @@ class ResultView:
             )
         )
 
+        pager = ttk.Frame(self.container, style="Card.TFrame")
+        pager.grid(row=2, column=0, columnspan=2, sticky="ew", pady=(5, 0))
+
+        self.prev_button = ttk.Button(
+            pager,
+            text="◀ Previous",
+            command=lambda: self.on_page(self.page - 1),
+            state="disabled"
+        )
+        self.prev_button.pack(side="left", padx=10, pady=5)
+
+        self.page_label = ttk.Label(pager, text="", font=FONT, style="Info.TLabel")
+        self.page_label.pack(side="left", padx=10)
+
+        self.next_button = ttk.Button(
+            pager,
+            text="Next ▶",
+            command=lambda: self.on_page(self.page + 1),
+            state="disabled"
+        )
+        self.next_button.pack(side="left", padx=10, pady=5)
+
     def clear(self):
         """Remove previous results."""
         for widget in self.frame.winfo_children():
             widget.destroy()
 
-    def show_results(self, results):
+    def show_results(self, results, page=0, has_more=False):
         """
         Display query output.
-        Accepts either a string (error/info) or a 2D list.
+        Accepts either a string (error/info) or a 2D list, which is page
+        number `page` of the results.
         """
         self.clear()
+        self._show_pager(page, has_more and not isinstance(results, str))
 
         # UPDATE queries don't return a list
         if isinstance(results, str):
@@ -142,6 +174,12 @@ class ResultView:
         tree.tag_configure("oddrow", background=COLOURS["row_odd"])
         tree.tag_configure("evenrow", background=COLOURS["row_even"])
 
+    def _show_pager(self, page, has_more):
+        self.page = page
+        self.prev_button.configure(state="normal" if page > 0 else "disabled")
+        self.next_button.configure(state="normal" if has_more else "disabled")
+        self.page_label.configure(text=f"Page {page + 1}" if page or has_more else "")
+
 
 # -------------------------
 # Main application window
@@ -177,6 +215,9 @@ class App:
         self.tabs = ttk.Notebook(main, style="Custom.TNotebook")
         self.tabs.grid(row=0, column=0, sticky="nsew")
 
+        self.status = ttk.Label(main, text="", font=FONT, style="Status.TLabel")
+        self.status.grid(row=1, column=0, sticky="ew", pady=(8, 0))
+
         self.tab_frames = {
             "Home": ttk.Frame(self.tabs, style="Tab.TFrame"),
             "Querying": ttk.Frame(self.tabs, style="Tab.TFrame"),
@@ -189,10 +230,13 @@ class App:
             self.tabs.add(frame, text=f"  {name}  ")
 
         self.result_views = {}
+        self.pagers = {}
+        self.running = {}
 
         self._setup_home()
         self._setup_query_tab()
         self._setup_database_tab()
+        self._update_status()
         self._greet_user()
 
     def _center_window(self):
@@ -239,22 +283,129 @@ class App:
             style="Subtitle.TLabel"
         ).pack(anchor="w", pady=(2, 0))
 
-        graph_frame = ttk.Frame(tab, style="Card.TFrame")
-        graph_frame.grid(row=1, column=0, padx=20, pady=10, sticky="nsew")
-
-        graph = flaskr.plotting.BarchartPlot(self.app)
-        canvas = FigureCanvasTkAgg(graph, master=graph_frame)
+        self.live_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            header,
+            text="Auto-refresh",
+            variable=self.live_var,
+            command=self._toggle_live,
+            style="Toggle.TCheckbutton"
+        ).pack(anchor="w", pady=(8, 0))
+
+        self.graph_frame = ttk.Frame(tab, style="Card.TFrame")
+        self.graph_frame.grid(row=1, column=0, padx=20, pady=10, sticky="nsew")
+
+        self.live = None
+        self._refresh_job = None        # The one pending after() of the refresh loop
+        self._live_generation = 0
+        self._polling = False
+        self._poll_failures = 0
+        self._show_figure(flaskr.plotting.dashboard_figure(self.app))
+
+    def _show_figure(self, figure):
+        for child in self.graph_frame.winfo_children():
+            child.destroy()
+
+        canvas = FigureCanvasTkAgg(figure, master=self.graph_frame)
         canvas.draw()
         canvas.get_tk_widget().pack(fill="both", expand=True, padx=10, pady=10)
 
         toolbar = NavigationToolbar2Tk(
             canvas,
-            graph_frame,
+            self.graph_frame,
             pack_toolbar=False
         )
         toolbar.update()
         toolbar.pack(side="bottom", fill="x", padx=10, pady=(0, 10))
 
+    # Auto-refresh swaps in a LiveDashboard, which has a figure of its own
+    # and only reads the scans logged since it last looked
+
+    def _toggle_live(self):
+        # Every switch starts a new generation, and whatever an earlier one
+        # still has in flight is ignored when it lands, so only one refresh
+        # loop ever runs
+        self._live_generation += 1
+        self._poll_failures = 0
+        self._cancel_refresh()
+        if self.live_var.get():
+            threading.Thread(target=self._start_live, args=(self._live_generation,), daemon=True).start()
+
+    def _start_live(self, generation):
+        try:
+            # Switching back on carries on from where the last poll got to
+            live = self.live or flaskr.plotting.LiveDashboard(self.app)
+        except Exception as e:
+            self.root.after(0, lambda: self._live_failed(e, generation))
+            return
+
+        self.root.after(0, lambda: self._show_live(live, generation))
+
+    def _live_failed(self, error, generation):
+        if generation != self._live_generation:
+            return
+        self.live_var.set(False)
+        messagebox.showerror("Error", str(error))
+
+    def _show_live(self, live, generation):
+        if generation != self._live_generation:
+            return      # Switched off (or off and on again) in the meantime
+
+        if self.live is not live:
+            self.live = live
+            self._show_figure(live.figure)
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        self._cancel_refresh()
+        self._refresh_job = self.root.after(LIVE_REFRESH_MS, self._refresh_live, self._live_generation)
+
+    def _cancel_refresh(self):
+        if self._refresh_job is not None:
+            self.root.after_cancel(self._refresh_job)
+            self._refresh_job = None
+
+    def _refresh_live(self, generation):
+        # Poll on a worker thread, draw back on the Tk thread
+        self._refresh_job = None
+        if self._polling:
+            # One from before a toggle is still out; two at once would count the same scans twice
+            self._schedule_refresh()
+            return
+
+        self._polling = True
+        threading.Thread(target=self._poll_live, args=(generation,), daemon=True).start()
+
+    def _poll_live(self, generation):
+        try:
+            changed, error = self.live.poll(), None
+        except Exception as e:
+            # Database busy or similar; a popup every tick would be worse, so
+            # log it and try again next time
+            self.app.logger.warning("Live dashboard poll failed", exc_info=True)
+            changed, error = False, e
+
+        self.root.after(0, lambda: self._redraw_live(changed, generation, error))
+
+    def _redraw_live(self, changed, generation, error=None):
+        self._polling = False
+        if generation != self._live_generation:
+            return      # Its loop was switched off; the current one has its own
+
+        if error is None:
+            self._poll_failures = 0
+        else:
+            self._poll_failures += 1
+            if self._poll_failures >= LIVE_MAX_FAILURES:
+                # Not going away on its own; stop rather than fail quietly forever
+                self._live_generation += 1
+                self._live_failed(error, self._live_generation)
+                return
+
+        if changed:
+            self.live.redraw()
+        self._schedule_refresh()
+
     # ---------------- QUERY TAB ---------------- #
 
     def _setup_query_tab(self):
@@ -277,6 +428,15 @@ class App:
             style="Subtitle.TLabel"
         ).pack(anchor="w", pady=(2, 0))
 
+        self.profile_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            header,
+            text="Profile",
+            variable=self.profile_var,
+            command=self._toggle_profile,
+            style="Toggle.TCheckbutton"
+        ).pack(anchor="w", pady=(8, 0))
+
         input_box = ttk.Frame(tab, style="Card.TFrame")
         input_box.grid(row=1, column=0, sticky="ew", padx=20, pady=10)
         input_box.grid_columnconfigure(1, weight=1)
@@ -309,9 +469,28 @@ class App:
                 self.query_entry.get(),
                 tab
             )
-        ).grid(row=0, column=2, padx=(0, 15), pady=15)
+        ).grid(row=0, column=2, padx=(0, 5), pady=15)
 
-        self.result_views[tab] = ResultView(tab)
+        self.cancel_button = ttk.Button(
+            input_box,
+            text="■ Cancel",
+            command=lambda: self.cancel_query(tab),
+            state="disabled"
+        )
+        self.cancel_button.grid(row=0, column=3, padx=(0, 15), pady=15)
+
+        self.result_views[tab] = ResultView(tab, lambda page: self._show_page(tab, page))
+
+        # Shown under the results while Profile is ticked
+        self.profile_label = ttk.Label(
+            tab,
+            text="Run a query to see where its time went.",
+            font=FONT_MONO,
+            style="Profile.TLabel",
+            justify="left",
+            anchor="nw",
+            padding=15
+        )
 
     # ---------------- DATABASE TAB ---------------- #
 
@@ -346,7 +525,7 @@ class App:
         ).grid(row=0, column=0, padx=15, pady=15, sticky="w")
 
         self.table_var = tk.StringVar(value="Users")
-        tables = ["Users", "Departments", "Accesslog"]
+        tables = ["Users", "Departments", "Accesslog", "AccessLogAll", "Alerts"]
 
         ttk.OptionMenu(
             select,
@@ -360,42 +539,161 @@ class App:
             select,
             text="📋 View Table",
             style="Primary.TButton",
-            command=lambda: self.run_query(
-                f"SELECT * FROM {self.table_var.get()}",
+            command=lambda: self.view_table(
+                self.table_var.get(),
                 tab
             )
         ).grid(row=0, column=2, padx=(0, 15), pady=15)
 
-        self.result_views[tab] = ResultView(tab)
+        self.result_views[tab] = ResultView(tab, lambda page: self._show_page(tab, page))
 
     # ---------------- QUERY EXECUTION ---------------- #
 
+    # Results are fetched a page at a time. self.pagers[tab](page, budget)
+    # returns (rows, has_more) for whatever that tab last ran, and
+    # self.running[tab] is the budget of the fetch in progress, if any.
+
     def run_query(self, query, tab):
+        page_size = self.app.config["QUERY_PAGE_SIZE"]
+
+        def fetch(page, budget):
+            # Ad-hoc queries have no key to page by, so later pages are
+            # streamed past rather than held
+            results = flaskr.querying.execute_sql_query(
+                query,
+                self.username,
+                limit=page_size + 1,
+                offset=page * page_size,
+                budget=budget
+            )
+            if isinstance(results, str):
+                return results, False
+            return results[:page_size], len(results) > page_size
+
+        self.pagers[tab] = fetch
+        self._show_page(tab, 0)
+
+    def view_table(self, table, tab):
+        after = [None]      # after[n]: the key page n starts after
+
+        def fetch(page, budget):
+            rows, next_after = flaskr.querying.fetch_table_page(
+                table,
+                self.username,
+                after=after[page],
+                budget=budget
+            )
+            del after[page + 1:]
+            if next_after is not None:
+                after.append(next_after)
+            return rows, next_after is not None
+
+        self.pagers[tab] = fetch
+        self._show_page(tab, 0)
+
+    def _show_page(self, tab, page):
+        # Whatever this tab was still running is no longer wanted
+        self.cancel_query(tab)
+
+        console = tab is self.tab_frames["Querying"]
+        # The plan costs a second prepare, so only ask for it when it'll be shown
+        budget = flaskr.querying.QueryBudget(profile=console and self.profile_var.get())
+        self.running[tab] = budget
+        if console:
+            self.cancel_button.configure(state="normal")
+
         # Run queries in background so the UI doesn’t freeze
         threading.Thread(
             target=self._execute_query,
-            args=(query, tab),
+            args=(self.pagers[tab], page, tab, budget),
             daemon=True     # What's a daemon?
         ).start()
 
-    def _execute_query(self, query, tab):
+    def cancel_query(self, tab):
+        budget = self.running.pop(tab, None)
+        if budget is not None:
+            budget.cancel()
+        if tab is self.tab_frames["Querying"]:
+            self.cancel_button.configure(state="disabled")
+
+    def _execute_query(self, fetch, page, tab, budget):
         try:
             with self.app.app_context():
-                results = flaskr.querying.execute_sql_query(
-                    query,
-                    self.username
-                )
+                results, has_more = fetch(page, budget)
 
             self.root.after(
                 0,
-                lambda: self.result_views[tab].show_results(results)
+                lambda: self._query_finished(tab, budget, results, page, has_more)
             )
 
         except Exception as e:
-            self.root.after(
-                0,
-                lambda: messagebox.showerror("Error", str(e))
-            )
+            if budget.cancelled:
+                # Cancelled on purpose, or replaced by a newer query
+                self.root.after(0, lambda: self._query_finished(tab, budget, str(e)))
+            else:
+                self.root.after(0, lambda: self._query_finished(tab, budget, error=e))
+
+    def _query_finished(self, tab, budget, results=None, page=0, has_more=False, error=None):
+        if self.running.get(tab) is budget:
+            self.running.pop(tab)
+            if tab is self.tab_frames["Querying"]:
+                self.cancel_button.configure(state="disabled")
+        elif budget.cancelled and self.running.get(tab) is not None:
+            return      # A newer query owns the results view now
+
+        if error is not None:
+            messagebox.showerror("Error", str(error))
+            render = None
+        else:
+            started = time.perf_counter()
+            self.result_views[tab].show_results(results, page, has_more)
+            self.root.update_idletasks()
+            render = time.perf_counter() - started
+
+        if tab is self.tab_frames["Querying"]:
+            self._show_profile(budget, render)
+        self._update_status()
+
+    # ---------------- PROFILING ---------------- #
+
+    def _toggle_profile(self):
+        if self.profile_var.get():
+            self.profile_label.grid(row=3, column=0, sticky="ew", padx=20, pady=(0, 20))
+        else:
+            self.profile_label.grid_remove()
+
+    def _show_profile(self, budget, render):
+        if budget.wall is None:
+            self.profile_label.configure(text="Answered from the result cache; nothing ran.")
+            return
+
+        timings = budget.timings
+        lines = [
+            f"Query {budget.wall * 1000:.1f} ms   "
+            f"execute {timings['execute'] * 1000:.1f} ms  ·  fetch {timings['fetch'] * 1000:.1f} ms  ·  "
+            f"redact {timings['redact'] * 1000:.1f} ms  ·  "
+            f"render {'-' if render is None else f'{render * 1000:.1f} ms'}",
+            f"{budget.rows:,} rows read   ~{budget.steps:,} VM steps"
+            + (f"   stopped: {budget.stopped}" if budget.stopped else ""),
+            "",
+            "Query plan:",
+        ]
+        lines += [f"  {line}" for line in budget.plan] or [
+            "  (none)" if budget.profile else "  (taken when Profile is ticked before running)"
+        ]
+        self.profile_label.configure(text="\n".join(lines))
+
+    def _update_status(self):
+        cache = flaskr.querying.query_cache_stats(self.app)
+        pool = flaskr.db.pool_stats(self.app)
+
+        lookups = cache["hits"] + cache["misses"]
+        hit_rate = f"{cache['hits'] / lookups:.0%}" if lookups else "-"
+        self.status.configure(
+            text=f"Query cache: {cache['hits']} hits, {cache['misses']} misses ({hit_rate}), "
+                 f"{cache['entries']} results in {cache['bytes'] / 1024 / 1024:.1f} MB"
+                 f"   |   Connections: {pool['in_use']} in use, {pool['idle']} idle"
+        )
 
     # ---------------- STYLING ---------------- #
 
@@ -471,6 +769,25 @@ class App:
             foreground=COLOURS["text_secondary"]
         )
 
+        self.style.configure(
+            "Status.TLabel",
+            background=COLOURS["background"],
+            foreground=COLOURS["text_secondary"]
+        )
+
+        self.style.configure(
+            "Profile.TLabel",
+            background=COLOURS["surface"],
+            foreground=COLOURS["text"]
+        )
+
+        self.style.configure(
+            "Toggle.TCheckbutton",
+            font=FONT,
+            background=COLOURS["background"],
+            foreground=COLOURS["text"]
+        )
+
         # Buttons
         self.style.configure(
             "Primary.TButton",